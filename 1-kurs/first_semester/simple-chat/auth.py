@@ -1,6 +1,10 @@
+import asyncio
 import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Tuple
 
 from jose import JWTError, jwt
 from passlib.context import CryptContext
@@ -8,6 +12,7 @@ from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlmodel.ext.asyncio.session import AsyncSession
 
+from metrics import Histogram
 from models import User
 from sqlmodel import select
 
@@ -15,10 +20,38 @@ from sqlmodel import select
 SECRET_KEY = os.getenv("SECRET_KEY", "dev-secret-key-change")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  # 1 day
-
-pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))  # seconds
+
+# Argon2 cost; unset values keep passlib's defaults. Changing them only
+# affects new hashes, existing ones still verify with their own parameters.
+ARGON2_SETTINGS = {
+    key: int(os.environ[env])
+    for key, env in (
+        ("argon2__time_cost", "ARGON2_TIME_COST"),
+        ("argon2__memory_cost", "ARGON2_MEMORY_COST"),  # KiB
+        ("argon2__parallelism", "ARGON2_PARALLELISM"),
+    )
+    if os.getenv(env)
+}
+# Hashing runs in its own small pool so logins never block the event loop;
+# beyond HASH_QUEUE_LIMIT waiting jobs new requests are turned away.
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", "2"))
+HASH_QUEUE_LIMIT = int(os.getenv("HASH_QUEUE_LIMIT", "32"))
+
+pwd_context = CryptContext(schemes=["argon2"], deprecated="auto", **ARGON2_SETTINGS)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/token")
 
+hash_executor = ThreadPoolExecutor(
+    max_workers=HASH_WORKERS, thread_name_prefix="argon2"
+)
+_hash_pending = 0
+
+hash_seconds = Histogram("argon2_hash_seconds", "Time spent computing Argon2 hashes")
+hash_wait_seconds = Histogram(
+    "argon2_queue_wait_seconds", "Time Argon2 jobs waited for a free worker"
+)
+
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
@@ -28,6 +61,41 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
+def _timed(submitted: float, fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, started - submitted, time.perf_counter() - started
+
+
+async def _run_hasher(fn, *args):
+    global _hash_pending
+    if _hash_pending >= HASH_WORKERS + HASH_QUEUE_LIMIT:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many login attempts in progress, try again shortly",
+            headers={"Retry-After": "1"},
+        )
+    _hash_pending += 1
+    try:
+        loop = asyncio.get_running_loop()
+        result, waited, took = await loop.run_in_executor(
+            hash_executor, _timed, time.perf_counter(), fn, *args
+        )
+    finally:
+        _hash_pending -= 1
+    hash_wait_seconds.observe(waited)
+    hash_seconds.observe(took)
+    return result
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await _run_hasher(verify_password, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    return await _run_hasher(get_password_hash, password)
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
     expire = datetime.utcnow() + (
@@ -52,11 +120,61 @@ async def authenticate_user(
     user = await get_user_by_username(session, username)
     if not user:
         return None
-    if not verify_password(password, user.hashed_password):
+    if not await verify_password_async(password, user.hashed_password):
         return None
     return user
 
 
+class UserCache:
+    """Bounded LRU of token -> detached User snapshot with a TTL.
+
+    Entries never outlive the token's own ``exp`` claim.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, User]]" = OrderedDict()
+
+    def get(self, token: str) -> Optional[User]:
+        entry = self._entries.get(token)
+        if entry is None:
+            return None
+        expires, user = entry
+        if expires <= time.monotonic():
+            del self._entries[token]
+            return None
+        self._entries.move_to_end(token)
+        return user
+
+    def set(self, token: str, user: User, exp: Optional[float] = None) -> None:
+        if self.maxsize <= 0:
+            return
+        ttl = self.ttl
+        if exp is not None:
+            ttl = min(ttl, exp - time.time())
+        if ttl <= 0:
+            return
+        self._entries[token] = (time.monotonic() + ttl, user)
+        self._entries.move_to_end(token)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate_user(self, user_id: int) -> None:
+        for token, (_, user) in list(self._entries.items()):
+            if user.id == user_id:
+                del self._entries[token]
+
+
+user_cache = UserCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+
+
+def user_snapshot(user: User) -> User:
+    # A transient copy is safe to share between requests: it is not bound
+    # to any session, so commits/rollbacks elsewhere never expire it.
+    return User(**{c.name: getattr(user, c.name) for c in User.__table__.columns})
+
+
 def decode_token(token: str) -> dict:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
@@ -0,0 +1,165 @@
+import asyncio
+import json
+import logging
+import os
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[dict], None]
+
+# "memory" keeps fan-out inside this process; "postgres" relays it to every
+# worker through LISTEN/NOTIFY on the chat database.
+CHAT_BACKPLANE = os.getenv("CHAT_BACKPLANE", "memory")
+BACKPLANE_CHANNEL = os.getenv("BACKPLANE_CHANNEL", "simplechat")
+
+
+class Backplane:
+    """Carries fan-out envelopes to every worker, including the sender."""
+
+    async def start(self, handler: Handler) -> None:
+        raise NotImplementedError
+
+    async def publish(self, envelope: dict) -> None:
+        raise NotImplementedError
+
+    async def stop(self) -> None:
+        pass
+
+
+class InMemoryBackplane(Backplane):
+    """Single-process stand-in: delivers straight to the local handler."""
+
+    def __init__(self):
+        self._handler: Optional[Handler] = None
+
+    async def start(self, handler: Handler) -> None:
+        self._handler = handler
+
+    async def publish(self, envelope: dict) -> None:
+        if self._handler is not None:
+            self._handler(envelope)
+
+    async def stop(self) -> None:
+        self._handler = None
+
+
+class PostgresBackplane(Backplane):
+    # NOTIFY payloads are capped at 8000 bytes by Postgres
+    MAX_PAYLOAD = 7900
+
+    def __init__(self, dsn: str, channel: str = BACKPLANE_CHANNEL):
+        self.dsn = dsn
+        self.channel = channel
+        self._handler: Optional[Handler] = None
+        self._listen_conn = None
+        self._publish_conn = None
+        self._publish_lock = asyncio.Lock()
+        self._reconnect_task: Optional[asyncio.Task] = None
+        self._stopping = False
+        # a publish was dropped; workers resync once publishing works again
+        self._publish_lost = False
+
+    async def start(self, handler: Handler) -> None:
+        self._handler = handler
+        self._stopping = False
+        await self._connect()
+
+    async def _connect(self) -> None:
+        import asyncpg
+
+        self._listen_conn = await asyncpg.connect(self.dsn)
+        self._listen_conn.add_termination_listener(self._on_terminated)
+        await self._listen_conn.add_listener(self.channel, self._on_notify)
+        if self._publish_conn is None or self._publish_conn.is_closed():
+            self._publish_conn = await asyncpg.connect(self.dsn)
+
+    def _on_notify(self, connection, pid, channel, payload: str) -> None:
+        try:
+            envelope = json.loads(payload)
+        except ValueError:
+            logger.warning("Ignoring malformed backplane payload")
+            return
+        if self._handler is not None:
+            self._handler(envelope)
+
+    def _on_terminated(self, connection) -> None:
+        if self._stopping or self._reconnect_task is not None:
+            return
+        self._reconnect_task = asyncio.create_task(self._reconnect())
+
+    async def _reconnect(self) -> None:
+        delay = 0.5
+        while not self._stopping:
+            try:
+                await self._connect()
+                break
+            except Exception:
+                logger.exception("Backplane reconnect failed")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 10)
+        self._reconnect_task = None
+        # Anything published while we were away is lost; make clients catch up
+        if not self._stopping and self._handler is not None:
+            self._handler({"kind": "resync"})
+
+    async def publish(self, envelope: dict) -> None:
+        """Never raises: callers publish after their write has committed."""
+        payload = _dumps(envelope)
+        if len(payload.encode("utf-8")) > self.MAX_PAYLOAD:
+            # Too big for NOTIFY: tell the recipients to re-fetch instead
+            payload = _dumps({"kind": "resync", "users": envelope.get("users")})
+        async with self._publish_lock:
+            try:
+                if self._publish_lost:
+                    await self._notify(_dumps({"kind": "resync"}))
+                    self._publish_lost = False
+                await self._notify(payload)
+            except Exception:
+                logger.exception("Backplane publish failed")
+                self._publish_lost = True
+
+    async def _notify(self, payload: str) -> None:
+        # one retry on a fresh connection covers a publish connection that
+        # dropped while the listen connection stayed up
+        for attempt in (1, 2):
+            try:
+                if self._publish_conn is None or self._publish_conn.is_closed():
+                    import asyncpg
+
+                    self._publish_conn = await asyncpg.connect(self.dsn)
+                await self._publish_conn.execute(
+                    "SELECT pg_notify($1, $2)", self.channel, payload
+                )
+                return
+            except Exception:
+                if attempt == 2:
+                    raise
+                conn, self._publish_conn = self._publish_conn, None
+                if conn is not None and not conn.is_closed():
+                    conn.terminate()
+
+    async def stop(self) -> None:
+        self._stopping = True
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+        for conn in (self._listen_conn, self._publish_conn):
+            if conn is not None and not conn.is_closed():
+                await conn.close()
+        self._listen_conn = self._publish_conn = None
+
+
+def _dumps(envelope: dict) -> str:
+    # NOTIFY limits bytes: keep non-ASCII text as UTF-8, not \uXXXX escapes
+    return json.dumps(envelope, separators=(",", ":"), ensure_ascii=False)
+
+
+def create_backplane(database_url: str) -> Backplane:
+    if CHAT_BACKPLANE == "memory":
+        return InMemoryBackplane()
+    if CHAT_BACKPLANE == "postgres":
+        dsn = os.getenv("BACKPLANE_URL") or database_url.replace(
+            "postgresql+asyncpg://", "postgresql://", 1
+        )
+        return PostgresBackplane(dsn)
+    raise ValueError(f"Unknown CHAT_BACKPLANE: {CHAT_BACKPLANE!r}")
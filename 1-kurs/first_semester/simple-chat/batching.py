@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import os
+from typing import List, Optional, Tuple, Union
+
+from conversations import Unread, record_messages
+from db import serialized_writes
+from models import PrivateMessage
+
+logger = logging.getLogger(__name__)
+
+# Optional write-behind mode for send_message: messages are queued and
+# inserted together, every BATCH_MAX_DELAY_MS or BATCH_MAX_ROWS rows.
+MESSAGE_BATCHING = os.getenv("MESSAGE_BATCHING", "") == "1"
+BATCH_MAX_ROWS = int(os.getenv("BATCH_MAX_ROWS", "100"))
+BATCH_MAX_DELAY_MS = float(os.getenv("BATCH_MAX_DELAY_MS", "5"))
+
+Pending = Tuple[PrivateMessage, asyncio.Future]
+# queued by stop(): the loop finishes its batch and exits
+_STOP = None
+
+
+class MessageBatcher:
+    """Groups concurrent inserts into one transaction.
+
+    Each caller awaits its own future, which resolves only after the batch
+    has committed, so a successful response still means the row is durable.
+    It resolves to the stored message and the receiver's unread count.
+    """
+
+    def __init__(
+        self,
+        session_factory,
+        max_rows: int = BATCH_MAX_ROWS,
+        max_delay: float = BATCH_MAX_DELAY_MS / 1000,
+    ):
+        self.session_factory = session_factory
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.queue: "asyncio.Queue[Optional[Pending]]" = asyncio.Queue()
+        self.task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self.task is None:
+            return
+        # not cancel(): a batch cut off mid-flush would never resolve its
+        # futures and its callers would wait forever
+        self.queue.put_nowait(_STOP)
+        await self.task
+        self.task = None
+        # flush whatever was queued after the stop signal
+        batch = []
+        while not self.queue.empty():
+            item = self.queue.get_nowait()
+            if item is not _STOP:
+                batch.append(item)
+        if batch:
+            await self._flush(batch)
+
+    async def submit(self, msg: PrivateMessage) -> Tuple[PrivateMessage, int]:
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((msg, future))
+        return await future
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self.queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            stopping = False
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_rows:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+            if stopping:
+                return
+
+    async def _flush(self, batch: List[Pending]) -> None:
+        try:
+            unread = await self._insert([msg for msg, _ in batch])
+        except Exception as exc:
+            if len(batch) == 1:
+                _resolve(batch, exc)
+                return
+            # one bad row must not fail everyone else's message
+            logger.warning("Batch insert failed, retrying rows one by one")
+            for msg, future in batch:
+                await self._flush([(_fresh(msg), future)])
+            return
+        _resolve(batch, unread)
+
+    async def _insert(self, msgs: List[PrivateMessage]) -> Unread:
+        async with serialized_writes(), self.session_factory() as session:
+            session.add_all(msgs)
+            # SQLAlchemy 2.0 sends this as a single multi-row
+            # INSERT ... RETURNING, matched back to the objects in order
+            await session.flush()
+            unread = await record_messages(session, msgs)
+            await session.commit()
+        return unread
+
+
+def _fresh(msg: PrivateMessage) -> PrivateMessage:
+    # the rolled-back instance may carry state from the failed flush
+    return PrivateMessage(
+        sender_id=msg.sender_id,
+        receiver_id=msg.receiver_id,
+        content=msg.content,
+        created_at=msg.created_at,
+    )
+
+
+def _resolve(batch: List[Pending], outcome: Union[Unread, BaseException]) -> None:
+    for msg, future in batch:
+        if future.done():
+            continue
+        if isinstance(outcome, BaseException):
+            future.set_exception(outcome)
+        else:
+            future.set_result((msg, outcome[(msg.receiver_id, msg.sender_id)]))
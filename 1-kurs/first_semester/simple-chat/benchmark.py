@@ -0,0 +1,421 @@
+"""Load-test harness for Simple Chat.
+
+Seeds a database, starts the app under uvicorn, drives concurrent traffic
+and prints per-scenario latency percentiles and throughput as JSON::
+
+    pip install -r requirements-bench.txt
+    DATABASE_URL=postgresql+asyncpg://... python benchmark.py --users 1000 \\
+        --messages 100000 --concurrency 50 --duration 20 --output before.json
+
+Scenarios: login, users (sidebar), poll (GET /messages with after_id),
+send (POST /messages) and ws (push latency from POST to the receiver's
+socket, over the --ws-protocol frame encoding). Point it at a throwaway
+database: bench users and messages are written into it.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List
+
+import httpx
+import msgpack
+import websockets
+
+PASSWORD = "bench-password"
+PREFIX = "bench"
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    # nearest-rank
+    rank = round(pct / 100 * len(sorted_values))
+    return sorted_values[max(0, min(len(sorted_values) - 1, rank - 1))]
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> Dict:
+    values = sorted(latencies)
+    return {
+        "requests": len(values),
+        "errors": errors,
+        "throughput_rps": round(len(values) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(values, 50) * 1000, 2),
+        "p95_ms": round(percentile(values, 95) * 1000, 2),
+        "p99_ms": round(percentile(values, 99) * 1000, 2),
+        "max_ms": round(values[-1] * 1000, 2) if values else 0.0,
+    }
+
+
+def failures(results: Dict) -> List[str]:
+    """Scenarios (or their parts) with errors or no successful request."""
+    found = []
+    for scenario, result in results.items():
+        parts = {scenario: result}
+        parts.update(
+            (f"{scenario}.{key}", value)
+            for key, value in result.items()
+            if isinstance(value, dict) and "errors" in value
+        )
+        for name, part in parts.items():
+            if "errors" not in part:
+                continue
+            if part["errors"] or not part["requests"]:
+                found.append(f"{name}: {part['requests']} ok, {part['errors']} errors")
+    return found
+
+
+def username(i: int) -> str:
+    return f"{PREFIX}{i:06d}"
+
+
+async def seed(users: int, messages: int) -> None:
+    """Create bench users and messages unless they already exist."""
+    from sqlalchemy import func
+    from sqlmodel import select
+
+    from auth import get_password_hash
+    from conversations import record_messages
+    from db import async_session, engine
+    from migrations import upgrade
+    from models import PrivateMessage, User
+
+    await upgrade()
+    async with async_session() as session:
+        existing = (
+            await session.execute(
+                select(func.count())
+                .select_from(User)
+                .where(User.username.like(f"{PREFIX}%"))
+            )
+        ).scalar()
+        if existing >= users:
+            print(f"seed: reusing {existing} bench users", file=sys.stderr)
+            await engine.dispose()
+            return
+        # one Argon2 hash shared by every bench user keeps seeding fast
+        hashed = get_password_hash(PASSWORD)
+        for start in range(existing, users, 1000):
+            session.add_all(
+                User(username=username(i), hashed_password=hashed, first_name="Bench")
+                for i in range(start, min(users, start + 1000))
+            )
+            await session.commit()
+        ids = (
+            (
+                await session.execute(
+                    select(User.id)
+                    .where(User.username.like(f"{PREFIX}%"))
+                    .order_by(User.id)
+                )
+            )
+            .scalars()
+            .all()
+        )
+
+        rng = random.Random(42)
+        now = datetime.utcnow()
+        step = timedelta(days=30) / max(messages, 1)
+        for start in range(0, messages, 5000):
+            batch = []
+            for i in range(start, min(messages, start + 5000)):
+                sender, receiver = rng.sample(ids, 2)
+                batch.append(
+                    PrivateMessage(
+                        sender_id=sender,
+                        receiver_id=receiver,
+                        content=f"bench message {i}",
+                        created_at=now - (messages - i) * step,
+                    )
+                )
+            session.add_all(batch)
+            await session.flush()
+            await record_messages(session, batch)
+            await session.commit()
+    print(f"seed: {users} users, {messages} messages", file=sys.stderr)
+    await engine.dispose()
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(port: int, workers: int, rate_limits: bool) -> subprocess.Popen:
+    env = dict(os.environ)
+    if not rate_limits:
+        # a handful of bench clients would otherwise trip the per-user limits
+        from ratelimit import LIMITS
+
+        env.update({f"RATE_LIMIT_{name.upper()}": "off" for name in LIMITS})
+    if workers > 1:
+        # the in-memory backplane would drop pushes that cross workers
+        env["CHAT_BACKPLANE"] = "postgres"
+    return subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "main:app",
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(port),
+            "--workers",
+            str(workers),
+            "--log-level",
+            "warning",
+        ],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+    )
+
+
+async def wait_until_up(base_url: str, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(f"{base_url}/static/styles.css")
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError("server did not start")
+
+
+async def login(client: httpx.AsyncClient, name: str) -> str:
+    res = await client.post("/token", data={"username": name, "password": PASSWORD})
+    res.raise_for_status()
+    return res.json()["access_token"]
+
+
+async def run_for(
+    duration: float, concurrency: int, make_call: Callable[[int], Awaitable[bool]]
+) -> Dict:
+    latencies: List[float] = []
+    errors = 0
+    deadline = time.monotonic() + duration
+
+    async def worker(n: int):
+        nonlocal errors
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                ok = await make_call(n)
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+
+    start = time.monotonic()
+    await asyncio.gather(*(worker(n) for n in range(concurrency)))
+    return summarize(latencies, errors, time.monotonic() - start)
+
+
+async def ws_scenario(
+    base_url: str, clients: List[httpx.AsyncClient], names: List[str], args
+) -> Dict:
+    """POST from one bench user, time until the receiver's socket sees it."""
+    ws_url = base_url.replace("http://", "ws://") + "/ws"
+    receivers = len(clients) // 2
+    pending: Dict[str, float] = {}
+    latencies: List[float] = []
+    received = {"bytes": 0, "events": 0}
+    subprotocols = [f"chat.v1.{args.ws_protocol}"]
+
+    async def listen(i: int, ready: asyncio.Event):
+        token = clients[i].headers["Authorization"].split(" ", 1)[1]
+        async with websockets.connect(
+            f"{ws_url}?token={token}", subprotocols=subprotocols
+        ) as ws:
+            ready.set()
+            async for frame in ws:
+                received["bytes"] += len(frame)
+                try:
+                    if isinstance(frame, bytes):
+                        events = msgpack.unpackb(frame)
+                    else:
+                        events = json.loads(frame)
+                except ValueError:
+                    continue
+                for event in events:
+                    received["events"] += 1
+                    if event.get("type") != "message":
+                        continue
+                    sent = pending.pop(event["message"]["content"], None)
+                    if sent is not None:
+                        latencies.append(time.perf_counter() - sent)
+
+    readies = [asyncio.Event() for _ in range(receivers)]
+    listeners = [asyncio.create_task(listen(i, readies[i])) for i in range(receivers)]
+    await asyncio.gather(*(r.wait() for r in readies))
+
+    counter = 0
+
+    async def send(n: int) -> bool:
+        nonlocal counter
+        counter += 1
+        content = f"ws-bench {n} {counter}"
+        peer = names[random.randrange(receivers)]
+        sender = clients[receivers + n % (len(clients) - receivers)]
+        pending[content] = time.perf_counter()
+        res = await sender.post(f"/messages/{peer}", data={"content": content})
+        return res.status_code == 200
+
+    start = time.monotonic()
+    posts = await run_for(args.duration, args.concurrency, send)
+    await asyncio.sleep(1)  # let in-flight pushes land
+    for task in listeners:
+        task.cancel()
+    # "errors" in push are messages whose event never arrived
+    push = summarize(latencies, len(pending), time.monotonic() - start)
+    return {
+        "sockets": receivers,
+        "protocol": args.ws_protocol,
+        "post": posts,
+        "push": push,
+        # payload bytes as the client sees them, after permessage-deflate
+        "bytes_per_event": round(received["bytes"] / max(received["events"], 1), 1),
+    }
+
+
+async def bench(args) -> Dict:
+    base_url = f"http://127.0.0.1:{args.port}"
+    count = min(args.concurrency * 2, args.users)
+    names = [username(i) for i in range(count)]
+    clients = [httpx.AsyncClient(base_url=base_url, timeout=30) for _ in range(count)]
+    try:
+        for client, name in zip(clients, names):
+            client.headers["Authorization"] = f"Bearer {await login(client, name)}"
+
+        # workers are numbered 0..concurrency-1; map them onto the bench users
+        async def do_login(n: int) -> bool:
+            n %= count
+            res = await clients[n].post(
+                "/token", data={"username": names[n], "password": PASSWORD}
+            )
+            return res.status_code == 200
+
+        async def do_users(n: int) -> bool:
+            n %= count
+            return (await clients[n].get("/users")).status_code == 200
+
+        last_seen: Dict[int, int] = {}
+
+        async def do_poll(n: int) -> bool:
+            n %= count
+            peer = names[(n + 1) % count]
+            params = {"after_id": last_seen[n]} if n in last_seen else {}
+            res = await clients[n].get(f"/messages/{peer}", params=params)
+            if res.status_code != 200:
+                return False
+            rows = res.json()
+            if rows:
+                last_seen[n] = rows[-1]["id"]
+            return True
+
+        async def do_send(n: int) -> bool:
+            n %= count
+            peer = names[(n + 1) % count]
+            res = await clients[n].post(
+                f"/messages/{peer}", data={"content": f"bench send {n}"}
+            )
+            return res.status_code == 200
+
+        scenarios = {
+            "login": do_login,
+            "users": do_users,
+            "poll": do_poll,
+            "send": do_send,
+        }
+        results = {}
+        for name in args.scenarios:
+            print(f"running {name}...", file=sys.stderr)
+            if name == "ws":
+                results[name] = await ws_scenario(base_url, clients, names, args)
+            else:
+                results[name] = await run_for(
+                    args.duration, args.concurrency, scenarios[name]
+                )
+        return results
+    finally:
+        for client in clients:
+            await client.aclose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=50000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument(
+        "--duration", type=float, default=10, help="seconds per scenario"
+    )
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers")
+    parser.add_argument(
+        "--scenarios",
+        nargs="+",
+        default=["login", "users", "poll", "send", "ws"],
+        choices=["login", "users", "poll", "send", "ws"],
+    )
+    parser.add_argument("--port", type=int, default=0, help="default: a free port")
+    parser.add_argument("--skip-seed", action="store_true")
+    parser.add_argument("--ws-protocol", choices=["json", "msgpack"], default="msgpack")
+    parser.add_argument(
+        "--rate-limits", action="store_true", help="keep the server's rate limits on"
+    )
+    parser.add_argument("--output", help="also write the JSON report here")
+    args = parser.parse_args()
+    args.port = args.port or free_port()
+    if args.workers > 1:
+        if os.getenv("DATABASE_URL", "").startswith("sqlite"):
+            parser.error("--workers > 1 needs Postgres; SQLite runs one worker")
+        if os.getenv("CHAT_BACKPLANE", "postgres") != "postgres":
+            parser.error("--workers > 1 needs CHAT_BACKPLANE=postgres")
+
+    if not args.skip_seed:
+        asyncio.run(seed(args.users, args.messages))
+    server = start_server(args.port, args.workers, args.rate_limits)
+    try:
+        asyncio.run(wait_until_up(f"http://127.0.0.1:{args.port}"))
+        results = asyncio.run(bench(args))
+    finally:
+        server.terminate()
+        server.wait()
+
+    report = {
+        "config": {
+            "database": os.getenv("DATABASE_URL", "default"),
+            "users": args.users,
+            "messages": args.messages,
+            "concurrency": args.concurrency,
+            "duration_s": args.duration,
+            "workers": args.workers,
+            "backplane": "postgres" if args.workers > 1 else "memory",
+            "rate_limits": args.rate_limits,
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    # a regression check, not just a report: any failed request fails the run
+    failed = failures(results)
+    if failed:
+        sys.exit("benchmark failed: " + "; ".join(failed))
+
+
+if __name__ == "__main__":
+    main()
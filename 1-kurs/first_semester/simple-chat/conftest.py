@@ -0,0 +1,56 @@
+"""
+Shared test setup: the app runs against a throwaway SQLite database.
+"""
+
+import os
+import tempfile
+
+_db_dir = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{_db_dir}/chat.db"
+os.environ["AUTO_MIGRATE"] = "1"
+# a small pool, so holding connections across awaits shows up as timeouts
+os.environ["DB_POOL_SIZE"] = "2"
+os.environ["DB_MAX_OVERFLOW"] = "1"
+os.environ["DB_POOL_TIMEOUT"] = "3"
+os.environ["MESSAGE_BATCHING"] = "1"
+# off here; test_ratelimit.py swaps in enabled limiters where it needs them
+for _name in ("SEND_USER", "SEND_IP", "AUTH_IP", "WS_CONNECT_IP", "WS_FRAMES_USER"):
+    os.environ[f"RATE_LIMIT_{_name}"] = "off"
+
+import pytest
+
+PASSWORD = "secret123"
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+
+    from main import app
+
+    with TestClient(app) as c:
+        yield c
+
+
+@pytest.fixture
+def login(client):
+    """Register ``username`` (once) and return its Authorization header."""
+
+    def login(username):
+        client.post(
+            "/register",
+            data={
+                "first_name": username,
+                "last_name": "Test",
+                "username": username,
+                "password": PASSWORD,
+            },
+            follow_redirects=False,
+        )
+        res = client.post("/token", data={"username": username, "password": PASSWORD})
+        assert res.status_code == 200
+        # the cookie would win over the header; tests pick users by header
+        client.cookies.clear()
+        return {"Authorization": f"Bearer {res.json()['access_token']}"}
+
+    return login
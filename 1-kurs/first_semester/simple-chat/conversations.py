@@ -0,0 +1,118 @@
+from typing import Dict, List, Tuple
+
+from sqlalchemy import case, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from models import Conversation, PrivateMessage
+
+
+def ordered_pair(user1_id: int, user2_id: int) -> Tuple[int, int]:
+    return (user1_id, user2_id) if user1_id < user2_id else (user2_id, user1_id)
+
+
+def unread_column(user_a_id: int, reader_id: int):
+    return Conversation.unread_a if reader_id == user_a_id else Conversation.unread_b
+
+
+Unread = Dict[Tuple[int, int], int]
+
+
+async def record_message(session: AsyncSession, msg: PrivateMessage) -> int:
+    """Like record_messages; returns the receiver's new unread count."""
+    unread = await record_messages(session, [msg])
+    return unread[(msg.receiver_id, msg.sender_id)]
+
+
+async def record_messages(session: AsyncSession, msgs: List[PrivateMessage]) -> Unread:
+    """Upsert the summary rows for a batch of new (flushed) messages.
+
+    One multi-row upsert per call, one row per pair. Runs in the caller's
+    transaction so the summaries commit with the messages. Returns the
+    updated unread counters keyed by (receiver id, sender id).
+    """
+    rows: Dict[Tuple[int, int], dict] = {}
+    for msg in msgs:
+        user_a_id, user_b_id = ordered_pair(msg.sender_id, msg.receiver_id)
+        row = rows.setdefault(
+            (user_a_id, user_b_id),
+            {
+                "user_a_id": user_a_id,
+                "user_b_id": user_b_id,
+                "last_message_id": msg.id,
+                "last_activity_at": msg.created_at,
+                "unread_a": 0,
+                "unread_b": 0,
+            },
+        )
+        if msg.id > row["last_message_id"]:
+            row["last_message_id"] = msg.id
+            row["last_activity_at"] = msg.created_at
+        row["unread_a" if msg.receiver_id == user_a_id else "unread_b"] += 1
+    if not rows:
+        return {}
+    # both dialects spell the upsert the same way
+    insert = sqlite_insert if session.bind.dialect.name == "sqlite" else pg_insert
+    # fixed lock order, so concurrent batches cannot deadlock on each other
+    stmt = insert(Conversation).values([rows[key] for key in sorted(rows)])
+    # concurrent senders may commit out of order; never move "last" backwards
+    newer = stmt.excluded.last_message_id > Conversation.last_message_id
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Conversation.user_a_id, Conversation.user_b_id],
+        set_={
+            "last_message_id": case(
+                (newer, stmt.excluded.last_message_id),
+                else_=Conversation.last_message_id,
+            ),
+            "last_activity_at": case(
+                (newer, stmt.excluded.last_activity_at),
+                else_=Conversation.last_activity_at,
+            ),
+            "unread_a": Conversation.unread_a + stmt.excluded.unread_a,
+            "unread_b": Conversation.unread_b + stmt.excluded.unread_b,
+        },
+    ).returning(
+        Conversation.user_a_id,
+        Conversation.user_b_id,
+        Conversation.unread_a,
+        Conversation.unread_b,
+    )
+    unread: Unread = {}
+    for user_a_id, user_b_id, unread_a, unread_b in await session.execute(stmt):
+        unread[(user_a_id, user_b_id)] = unread_a
+        unread[(user_b_id, user_a_id)] = unread_b
+    return unread
+
+
+async def record_read(
+    session: AsyncSession, reader_id: int, sender_id: int, count: int
+) -> int:
+    """Take ``count`` newly read messages off the reader's unread counter.
+
+    Returns what is left unread from that sender.
+    """
+    user_a_id, user_b_id = ordered_pair(reader_id, sender_id)
+    unread = unread_column(user_a_id, reader_id)
+    res = await session.execute(
+        update(Conversation)
+        .where(
+            Conversation.user_a_id == user_a_id,
+            Conversation.user_b_id == user_b_id,
+        )
+        .values({unread.name: case((unread > count, unread - count), else_=0)})
+        .returning(unread)
+    )
+    return res.scalar() or 0
+
+
+async def unread_count(session: AsyncSession, reader_id: int, sender_id: int) -> int:
+    """The reader's unread counter for messages from ``sender_id``."""
+    user_a_id, user_b_id = ordered_pair(reader_id, sender_id)
+    res = await session.execute(
+        select(unread_column(user_a_id, reader_id)).where(
+            Conversation.user_a_id == user_a_id,
+            Conversation.user_b_id == user_b_id,
+        )
+    )
+    return res.scalar() or 0
@@ -1,5 +1,7 @@
-from typing import List, Optional
-from datetime import datetime
+import asyncio
+import os
+from typing import Dict, Iterable, Optional, Set
+from datetime import datetime, timedelta, timezone
 from fastapi import (
     FastAPI,
     WebSocket,
@@ -12,57 +14,292 @@ from fastapi import (
     Header,
     Query,
 )
-from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import HTMLResponse, PlainTextResponse, RedirectResponse
 from fastapi.security import OAuth2PasswordRequestForm
 
 from sqlmodel import select
-from sqlalchemy import or_, and_, func
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import (
+    or_,
+    and_,
+    case,
+    column,
+    func,
+    literal_column,
+    table,
+    union,
+    union_all,
+    update,
+)
 
-from db import async_session, init_db, run_migrations
+from backplane import Backplane, create_backplane
+from batching import MESSAGE_BATCHING, MessageBatcher
+from db import (
+    DATABASE_URL,
+    IS_SQLITE,
+    SEARCH_CONFIG,
+    async_session,
+    get_session,
+    pool_status,
+    serialized_writes,
+)
 
 from auth import (
     create_access_token,
-    get_password_hash,
+    get_password_hash_async,
+    hash_executor,
     authenticate_user,
     decode_token,
     get_user_by_username,
+    user_cache,
+    user_snapshot,
+)
+from conversations import record_message, record_read, unread_count
+from migrations import check_schema, maintain_partitions
+from models import Conversation, User, PrivateMessage
+from pages import page_cache
+from presence import PresenceRegistry
+from ratelimit import LIMITS, client_ip, limit_ip
+from serializers import (
+    MESSAGE_COLUMNS,
+    FastJSONResponse,
+    me_payload,
+    message_payload,
+    message_rows,
+    user_rows,
 )
-from models import User, PrivateMessage
+from usernames import username_index
+from wsproto import Frame
+import wsproto
+import metrics
+
+# Comma-separated usernames allowed to read /admin/* endpoints
+ADMIN_USERNAMES = {
+    name.strip().lower()
+    for name in os.getenv("ADMIN_USERNAMES", "").split(",")
+    if name.strip()
+}
+
+# Optional bearer token required to scrape /metrics
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
 
 app = FastAPI(title="Simple Chat")
-app.mount("/static", StaticFiles(directory="static"), name="static")
+app.add_middleware(metrics.RequestTimingMiddleware)
+
+
+# Per-socket outbound queue length before a client is considered too slow
+WS_OUTBOX_SIZE = int(os.getenv("WS_OUTBOX_SIZE", "256"))
+RESYNC = Frame({"type": "resync"})
+# Most missed messages replayed on resume; a longer gap gets a resync instead
+WS_RESUME_LIMIT = int(os.getenv("WS_RESUME_LIMIT", "500"))
+# Slack on the client's "since" timestamp: ids and created_at can disagree
+# slightly between workers, the id filter still removes duplicates
+RESUME_CLOCK_SKEW = timedelta(seconds=30)
+# Close code for sockets that exceed their frame rate (policy violation)
+WS_CLOSE_RATE_LIMITED = 1008
+
+
+fanout_seconds = metrics.Histogram(
+    "ws_fanout_duration_seconds", "Time to enqueue one event for its local sockets"
+)
+
+
+class ClientConnection:
+    """One accepted socket with its own bounded outbox and writer task."""
+
+    def __init__(self, websocket: WebSocket, user_id: int, protocol: Optional[str]):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.protocol = protocol
+        self.outbox: asyncio.Queue = asyncio.Queue(maxsize=WS_OUTBOX_SIZE)
+        self.resync_pending = False
+        self.writer: Optional[asyncio.Task] = None
+
+    def enqueue(self, frame: Frame) -> bool:
+        if self.protocol is wsproto.LEGACY and frame.legacy is None:
+            # the public chat page prints every frame: chat lines only
+            return True
+        try:
+            self.outbox.put_nowait(frame)
+            return True
+        except asyncio.QueueFull:
+            pass
+        if self.resync_pending or self.protocol is wsproto.LEGACY:
+            # still hasn't drained the previous resync notice; give up on it
+            return False
+        # Drop the backlog and ask the client to re-fetch what it missed
+        while not self.outbox.empty():
+            self.outbox.get_nowait()
+        self.outbox.put_nowait(RESYNC)
+        self.resync_pending = True
+        return True
+
+    async def run_writer(self, manager: "ConnectionManager"):
+        try:
+            while True:
+                batch = [await self.outbox.get()]
+                if self.protocol is not wsproto.LEGACY:
+                    # everything already queued rides along in one frame
+                    while len(batch) < wsproto.MAX_BATCH and not self.outbox.empty():
+                        batch.append(self.outbox.get_nowait())
+                if RESYNC in batch:
+                    self.resync_pending = False
+                data = wsproto.encode(self.protocol, batch)
+                if isinstance(data, bytes):
+                    await self.websocket.send_bytes(data)
+                else:
+                    await self.websocket.send_text(data)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            manager.disconnect(self.websocket)
 
 
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
+    def __init__(self, backplane: Backplane):
+        self.backplane = backplane
+        self.active_connections: Dict[WebSocket, ClientConnection] = {}
+        # user id -> that user's open sockets (one per tab/device)
+        self.user_connections: Dict[int, Set[ClientConnection]] = {}
+        # pending closes of dropped sockets; the loop only keeps weak refs
+        self.closing: Set[asyncio.Task] = set()
 
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
+    async def connect(self, websocket: WebSocket, user_id: int) -> ClientConnection:
+        protocol = wsproto.negotiate(websocket.scope.get("subprotocols", []))
+        await websocket.accept(subprotocol=protocol)
+        client = ClientConnection(websocket, user_id, protocol)
+        self.active_connections[websocket] = client
+        if protocol is not wsproto.LEGACY:
+            # per-user events are typed; legacy sockets only get broadcasts
+            self.user_connections.setdefault(user_id, set()).add(client)
+        client.writer = asyncio.create_task(client.run_writer(self))
+        return client
 
     def disconnect(self, websocket: WebSocket):
+        client = self.active_connections.pop(websocket, None)
+        if client is None:
+            return
+        if client.writer is not None and client.writer is not asyncio.current_task():
+            client.writer.cancel()
+        sockets = self.user_connections.get(client.user_id)
+        if sockets is not None:
+            sockets.discard(client)
+            if not sockets:
+                del self.user_connections[client.user_id]
+
+    def _deliver(self, clients: Iterable[ClientConnection], frame: Frame):
+        # Never awaits: a slow socket only fills its own outbox
+        with fanout_seconds.time():
+            for client in list(clients):
+                if not client.enqueue(frame):
+                    self.drop(client)
+
+    def send_local(self, websocket: WebSocket, frame: Frame):
+        # One socket on this worker only, e.g. replies to its own handshake
+        client = self.active_connections.get(websocket)
+        if client is not None:
+            self._deliver((client,), frame)
+
+    def drop(self, client: ClientConnection):
+        self.disconnect(client.websocket)
+        task = asyncio.create_task(self._close(client.websocket))
+        self.closing.add(task)
+        task.add_done_callback(self.closing.discard)
+
+    @staticmethod
+    async def _close(websocket: WebSocket):
         try:
-            self.active_connections.remove(websocket)
-        except ValueError:
+            await websocket.close(code=1013)
+        except Exception:
             pass
 
+    # Local delivery, called for every envelope arriving from the backplane
+    def deliver_broadcast(self, frame: Frame):
+        self._deliver(self.active_connections.values(), frame)
+
+    def deliver_to_users(self, user_ids: Iterable[int], frame: Frame):
+        for user_id in set(user_ids):
+            self._deliver(self.user_connections.get(user_id, ()), frame)
+
+    # Publishing goes through the backplane so every worker sees it
     async def broadcast(self, message: str):
-        for connection in list(self.active_connections):
-            try:
-                await connection.send_text(message)
-            except Exception:
-                self.disconnect(connection)
+        await self.backplane.publish({"kind": "broadcast", "text": message})
+
+    async def send_to_users(self, user_ids: Iterable[int], event: dict):
+        await self.backplane.publish(
+            {
+                "kind": "users",
+                "users": sorted(set(user_ids)),
+                "event": jsonable_encoder(event),
+            }
+        )
+
 
+backplane = create_backplane(DATABASE_URL)
+metrics.Gauge(
+    "ws_active_connections",
+    "Open WebSocket connections on this worker",
+    lambda: len(manager.active_connections),
+)
+message_batcher = MessageBatcher(async_session) if MESSAGE_BATCHING else None
+manager = ConnectionManager(backplane)
+presence = PresenceRegistry(
+    backplane.publish,
+    deliver=lambda client, event: manager._deliver((client,), Frame(event)),
+    expire=manager.drop,
+)
 
-manager = ConnectionManager()
+
+def handle_envelope(envelope: dict):
+    kind = envelope.get("kind")
+    if kind == "users":
+        # encoded at most once per protocol, shared by all local recipients
+        manager.deliver_to_users(envelope["users"], Frame(envelope["event"]))
+    elif kind == "broadcast":
+        text = envelope["text"]
+        manager.deliver_broadcast(Frame({"type": "chat", "text": text}, legacy=text))
+    elif kind == "resync":
+        users = envelope.get("users")
+        if users is None:
+            manager.deliver_broadcast(RESYNC)
+        else:
+            manager.deliver_to_users(users, RESYNC)
+    elif kind == "invalidate_user":
+        user_cache.invalidate_user(envelope["user_id"])
+    elif kind == "username_taken":
+        username_index.add(envelope["username"])
+    elif kind == "presence":
+        presence.apply(envelope)
+
+
+# Worker-lifetime tasks, cancelled on shutdown
+background_tasks: Set[asyncio.Task] = set()
 
 
 @app.on_event("startup")
 async def on_startup():
-    await init_db()
-    await run_migrations()
+    page_cache.preload()
+    await check_schema()
+    if not IS_SQLITE:
+        background_tasks.add(asyncio.create_task(maintain_partitions()))
+    await backplane.start(handle_envelope)
+    await presence.start()
+    # in the background: until it is warm, availability checks ask the DB
+    background_tasks.add(asyncio.create_task(username_index.warm(async_session)))
+    if message_batcher is not None:
+        await message_batcher.start()
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    if message_batcher is not None:
+        await message_batcher.stop()
+    await presence.stop()
+    await backplane.stop()
+    for task in background_tasks:
+        task.cancel()
+    hash_executor.shutdown(wait=False)
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -88,16 +325,21 @@ async def index(request: Request):
             pass
 
     # Serve login page; client will handle redirect after auth
-    with open("static/login.html", "r", encoding="utf-8") as f:
-        return HTMLResponse(f.read())
+    return page_cache.response(request, "login.html")
+
 
+@app.api_route("/static/{path:path}", methods=["GET", "HEAD"])
+async def static_files(path: str, request: Request):
+    return page_cache.response(request, path)
 
-@app.post("/register")
+
+@app.post("/register", dependencies=[Depends(limit_ip("auth_ip"))])
 async def register(
     first_name: str = Form(...),
     last_name: str = Form(...),
     username: str = Form(...),
     password: str = Form(...),
+    session: AsyncSession = Depends(get_session),
 ):
     # normalize and validate username (store lowercase)
     username = username.strip().lower()
@@ -108,72 +350,81 @@ async def register(
             status_code=400, detail="Username must be between 5 and 32 characters"
         )
 
-    async with async_session() as session:
-        q = await session.execute(select(User).where(User.username == username))
-        exists = q.scalar_one_or_none()
-        if exists:
-            raise HTTPException(status_code=400, detail="Username already taken")
-
-        user = User(
-            username=username,
-            hashed_password=get_password_hash(password),
-            first_name=first_name,
-            last_name=last_name,
-        )
+    if username_index.is_taken(username):
+        raise HTTPException(status_code=400, detail="Username already taken")
+    q = await session.execute(select(User).where(User.username == username))
+    exists = q.scalar_one_or_none()
+    if exists:
+        raise HTTPException(status_code=400, detail="Username already taken")
+
+    user = User(
+        username=username,
+        hashed_password=await get_password_hash_async(password),
+        first_name=first_name,
+        last_name=last_name,
+    )
+    async with serialized_writes():
         session.add(user)
         await session.commit()
-        await session.refresh(user)
-        token = create_access_token({"sub": user.username})
-        response = RedirectResponse(url="/home", status_code=303)
-        # set raw token (no "Bearer " prefix) to match /token behavior
-        response.set_cookie(key="access_token", value=token, httponly=True)
-        return response
+    await session.refresh(user)
+    username_index.add(user.username)
+    await backplane.publish({"kind": "username_taken", "username": user.username})
+    token = create_access_token({"sub": user.username})
+    response = RedirectResponse(url="/home", status_code=303)
+    # set raw token (no "Bearer " prefix) to match /token behavior
+    response.set_cookie(key="access_token", value=token, httponly=True)
+    return response
 
 
 from fastapi.responses import JSONResponse
 
 
-@app.post("/token")
+@app.post("/token", dependencies=[Depends(limit_ip("auth_ip"))])
 async def login_for_access_token(
-    request: Request, form_data: OAuth2PasswordRequestForm = Depends()
+    request: Request,
+    form_data: OAuth2PasswordRequestForm = Depends(),
+    session: AsyncSession = Depends(get_session),
 ):
-    async with async_session() as session:
-        user = await authenticate_user(session, form_data.username, form_data.password)
-        if not user:
-            # for form submissions return a user-friendly page error
-            raise HTTPException(
-                status_code=400, detail="Incorrect username or password"
-            )
-        access_token = create_access_token({"sub": user.username})
-        # set HttpOnly cookie so frontend JS cannot read it (mitigates XSS)
-        # For local dev, secure=False. In production set secure=True and samesite='lax' or 'strict'
-        if "text/html" in request.headers.get("accept", ""):
-            resp = RedirectResponse(url="/home")
-            resp.set_cookie(
-                key="access_token", value=access_token, httponly=True, samesite="lax"
-            )
-            return resp
-        else:
-            resp = JSONResponse({"access_token": access_token, "token_type": "bearer"})
-            resp.set_cookie(
-                key="access_token", value=access_token, httponly=True, samesite="lax"
-            )
-            return resp
+    user = await authenticate_user(session, form_data.username, form_data.password)
+    if not user:
+        # for form submissions return a user-friendly page error
+        raise HTTPException(status_code=400, detail="Incorrect username or password")
+    access_token = create_access_token({"sub": user.username})
+    # set HttpOnly cookie so frontend JS cannot read it (mitigates XSS)
+    # For local dev, secure=False. In production set secure=True and samesite='lax' or 'strict'
+    if "text/html" in request.headers.get("accept", ""):
+        resp = RedirectResponse(url="/home")
+        resp.set_cookie(
+            key="access_token", value=access_token, httponly=True, samesite="lax"
+        )
+        return resp
+    else:
+        resp = JSONResponse({"access_token": access_token, "token_type": "bearer"})
+        resp.set_cookie(
+            key="access_token", value=access_token, httponly=True, samesite="lax"
+        )
+        return resp
 
 
 @app.get("/username-available")
-async def username_available(username: str):
+async def username_available(
+    username: str, session: AsyncSession = Depends(get_session)
+):
     username = username.strip().lower()
     if len(username) < 5 or len(username) > 32:
         return {"available": False}
-    async with async_session() as session:
+    # answered from memory; the database is only asked before warm-up ends
+    taken = username_index.is_taken(username)
+    if taken is None:
         q = await session.execute(select(User).where(User.username == username))
-        exists = q.scalar_one_or_none()
-        return {"available": exists is None}
+        taken = q.scalar_one_or_none() is not None
+    return {"available": not taken}
 
 
 async def get_current_user(
-    request: Request, authorization: Optional[str] = Header(None, alias="Authorization")
+    request: Request,
+    authorization: Optional[str] = Header(None, alias="Authorization"),
+    session: AsyncSession = Depends(get_session),
 ):
     # Prefer cookie token (HttpOnly), fall back to Authorization header
     token_value = request.cookies.get("access_token")
@@ -185,63 +436,91 @@ async def get_current_user(
         )
     if token_value.startswith("Bearer "):
         token_value = token_value.split(" ", 1)[1]
+    cached = user_cache.get(token_value)
+    if cached is not None:
+        return cached
     payload = decode_token(token_value)
     username: str = payload.get("sub")
     if username is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token"
         )
-    async with async_session() as session:
-        q = await session.execute(select(User).where(User.username == username))
-        user = q.scalar_one_or_none()
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
-        return user
+    q = await session.execute(select(User).where(User.username == username))
+    user = q.scalar_one_or_none()
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    user = user_snapshot(user)
+    user_cache.set(token_value, user, payload.get("exp"))
+    return user
 
 
 @app.get("/me")
 async def read_me(current_user: User = Depends(get_current_user)):
-    return {
-        "id": current_user.id,
-        "username": current_user.username,
-        "first_name": current_user.first_name,
-        "last_name": current_user.last_name,
-        "bio": current_user.bio,
-        "created_at": current_user.created_at,
-    }
+    return FastJSONResponse(me_payload(current_user))
+
+
+def like_prefix(value: str) -> str:
+    # typed text matches literally: % and _ are not wildcards here
+    escaped = value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return escaped + "%"
 
 
 @app.get("/users")
-async def list_users(current_user: User = Depends(get_current_user)):
-    async with async_session() as session:
-        q = await session.execute(select(User))
-        users = q.scalars().all()
-        result = []
-        for user in users:
-            if user.id == current_user.id:
-                continue
-            unread_q = await session.execute(
-                select(func.count())
-                .select_from(PrivateMessage)
-                .where(
-                    and_(
-                        PrivateMessage.sender_id == user.id,
-                        PrivateMessage.receiver_id == current_user.id,
-                        PrivateMessage.read_at.is_(None),
-                    )
+async def list_users(
+    q: Optional[str] = Query(None, max_length=64),
+    after: Optional[str] = Query(None, max_length=32),
+    limit: int = Query(50, ge=1, le=200),
+    current_user: User = Depends(get_current_user),
+    session: AsyncSession = Depends(get_session),
+):
+    me = current_user.id
+    # Unread badges come from the maintained conversation counters: one
+    # primary-key probe per listed user, no counting
+    unread = case(
+        (Conversation.user_a_id == me, Conversation.unread_a),
+        else_=Conversation.unread_b,
+    )
+    stmt = (
+        select(
+            User.id,
+            User.username,
+            User.first_name,
+            User.last_name,
+            User.bio,
+            func.coalesce(unread, 0),
+        )
+        .outerjoin(
+            Conversation,
+            or_(
+                and_(Conversation.user_a_id == me, Conversation.user_b_id == User.id),
+                and_(Conversation.user_a_id == User.id, Conversation.user_b_id == me),
+            ),
+        )
+        .where(User.id != me)
+    )
+    if q:
+        prefix = like_prefix(q.strip().lower())
+        # one prefix range scan per column (username, and the migration 6
+        # lower() indexes); an OR here lets the planner walk the username
+        # index for the ORDER BY and filter every row instead
+        matches = union(
+            *(
+                select(User.id).where(expr.like(prefix, escape="\\"))
+                for expr in (
+                    User.username,
+                    func.lower(User.first_name),
+                    func.lower(User.last_name),
                 )
             )
-            unread_count = unread_q.scalar() or 0
-            result.append(
-                {
-                    "username": user.username,
-                    "first_name": user.first_name,
-                    "last_name": user.last_name,
-                    "bio": user.bio,
-                    "unread": unread_count,
-                }
-            )
-        return result
+        ).subquery()
+        stmt = stmt.where(User.id.in_(select(matches.c.id)))
+    # keyset pagination by username (unique, indexed)
+    if after:
+        stmt = stmt.where(User.username > after.strip().lower())
+    stmt = stmt.order_by(User.username).limit(limit)
+
+    rows = (await session.execute(stmt)).all()
+    return FastJSONResponse(user_rows(rows))
 
 
 @app.get("/home", response_class=HTMLResponse)
@@ -250,8 +529,7 @@ async def home(request: Request):
     cookie_token = request.cookies.get("access_token")
     if not cookie_token:
         return RedirectResponse(url="/")
-    with open("static/home.html", "r", encoding="utf-8") as f:
-        return HTMLResponse(f.read())
+    return page_cache.response(request, "home.html")
 
 
 @app.get("/profile", response_class=HTMLResponse)
@@ -260,14 +538,12 @@ async def profile(request: Request):
     cookie_token = request.cookies.get("access_token")
     if not cookie_token:
         return RedirectResponse(url="/")
-    with open("static/profile.html", "r", encoding="utf-8") as f:
-        return HTMLResponse(f.read())
+    return page_cache.response(request, "profile.html")
 
 
 @app.get("/user/{username}", response_class=HTMLResponse)
-async def public_profile(username: str):
-    with open("static/user.html", "r", encoding="utf-8") as f:
-        return HTMLResponse(f.read())
+async def public_profile(username: str, request: Request):
+    return page_cache.response(request, "user.html")
 
 
 @app.patch("/me")
@@ -276,128 +552,414 @@ async def update_me(
     last_name: Optional[str] = Form(None),
     bio: Optional[str] = Form(None),
     current_user: User = Depends(get_current_user),
+    session: AsyncSession = Depends(get_session),
 ):
-    async with async_session() as session:
-        q = await session.execute(select(User).where(User.id == current_user.id))
-        user = q.scalar_one_or_none()
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
-        if first_name is not None:
-            user.first_name = first_name
-        if last_name is not None:
-            user.last_name = last_name
-        if bio is not None:
-            user.bio = bio
+    q = await session.execute(select(User).where(User.id == current_user.id))
+    user = q.scalar_one_or_none()
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    if first_name is not None:
+        user.first_name = first_name
+    if last_name is not None:
+        user.last_name = last_name
+    if bio is not None:
+        user.bio = bio
+    async with serialized_writes():
         session.add(user)
         await session.commit()
-        await session.refresh(user)
-        return {
-            "username": user.username,
-            "first_name": user.first_name,
-            "last_name": user.last_name,
-            "bio": user.bio,
-            "created_at": user.created_at,
-        }
+    await session.refresh(user)
+    # drop cached snapshots of this user on every worker
+    await backplane.publish({"kind": "invalidate_user", "user_id": user.id})
+    return {
+        "username": user.username,
+        "first_name": user.first_name,
+        "last_name": user.last_name,
+        "bio": user.bio,
+        "created_at": user.created_at,
+    }
 
 
 @app.get("/users/{username}")
-async def get_user(username: str, current_user: User = Depends(get_current_user)):
-    async with async_session() as session:
-        q = await session.execute(select(User).where(User.username == username))
-        user = q.scalar_one_or_none()
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
-        return {
-            "username": user.username,
-            "first_name": user.first_name,
-            "last_name": user.last_name,
-            "bio": user.bio,
-            "created_at": user.created_at,
+async def get_user(
+    username: str,
+    current_user: User = Depends(get_current_user),
+    session: AsyncSession = Depends(get_session),
+):
+    q = await session.execute(select(User).where(User.username == username))
+    user = q.scalar_one_or_none()
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return {
+        "username": user.username,
+        "first_name": user.first_name,
+        "last_name": user.last_name,
+        "bio": user.bio,
+        "created_at": user.created_at,
+    }
+
+
+@app.get("/conversations")
+async def list_conversations(
+    before: Optional[datetime] = Query(None),
+    before_user: Optional[int] = Query(None, ge=1),
+    limit: int = Query(30, ge=1, le=100),
+    current_user: User = Depends(get_current_user),
+    session: AsyncSession = Depends(get_session),
+):
+    # Recent chats with a last-message preview, newest first, read straight
+    # from the per-pair summary rows.
+    me = current_user.id
+    is_a = Conversation.user_a_id == me
+    peer_id = case((is_a, Conversation.user_b_id), else_=Conversation.user_a_id)
+    unread = case((is_a, Conversation.unread_a), else_=Conversation.unread_b)
+    stmt = (
+        select(
+            User.id,
+            User.username,
+            User.first_name,
+            User.last_name,
+            Conversation.last_message_id,
+            Conversation.last_activity_at,
+            unread,
+            PrivateMessage.sender_id,
+            func.substr(PrivateMessage.content, 1, 120),
+        )
+        .join(User, User.id == peer_id)
+        .outerjoin(
+            PrivateMessage,
+            and_(
+                PrivateMessage.id == Conversation.last_message_id,
+                # lets Postgres prune straight to the right monthly partition
+                PrivateMessage.created_at == Conversation.last_activity_at,
+            ),
+        )
+        .where(or_(Conversation.user_a_id == me, Conversation.user_b_id == me))
+    )
+    # keyset pagination on (last_activity_at, peer id), both descending:
+    # pass the last row's last_activity_at and user.id
+    if before is not None:
+        if before_user is None:
+            stmt = stmt.where(Conversation.last_activity_at < before)
+        else:
+            stmt = stmt.where(
+                or_(
+                    Conversation.last_activity_at < before,
+                    and_(
+                        Conversation.last_activity_at == before,
+                        peer_id < before_user,
+                    ),
+                )
+            )
+    stmt = stmt.order_by(Conversation.last_activity_at.desc(), peer_id.desc())
+    stmt = stmt.limit(limit)
+    rows = (await session.execute(stmt)).all()
+    return [
+        {
+            "user": {
+                "id": peer,
+                "username": username,
+                "first_name": first_name,
+                "last_name": last_name,
+            },
+            "last_message_id": last_message_id,
+            "last_activity_at": last_activity_at,
+            "last_sender_id": last_sender_id,
+            "preview": preview,
+            "unread": unread_count,
         }
+        for (
+            peer,
+            username,
+            first_name,
+            last_name,
+            last_message_id,
+            last_activity_at,
+            unread_count,
+            last_sender_id,
+            preview,
+        ) in rows
+    ]
 
 
 @app.get("/messages/{username}")
 async def get_messages(
     username: str,
     limit: int = Query(100, ge=1, le=500),
+    after_id: Optional[int] = Query(None, ge=1),
+    before_id: Optional[int] = Query(None, ge=1),
     current_user: User = Depends(get_current_user),
+    session: AsyncSession = Depends(get_session),
 ):
-    async with async_session() as session:
-        other = await get_user_by_username(session, username)
-        if not other:
-            raise HTTPException(status_code=404, detail="User not found")
-        q = await session.execute(
-            select(PrivateMessage)
-            .where(
-                or_(
-                    and_(
-                        PrivateMessage.sender_id == current_user.id,
-                        PrivateMessage.receiver_id == other.id,
-                    ),
-                    and_(
-                        PrivateMessage.sender_id == other.id,
-                        PrivateMessage.receiver_id == current_user.id,
-                    ),
+    if after_id is not None and before_id is not None:
+        raise HTTPException(
+            status_code=400, detail="Use either after_id or before_id, not both"
+        )
+    other = await get_user_by_username(session, username)
+    if not other:
+        raise HTTPException(status_code=404, detail="User not found")
+    # the rollback below expires ORM objects; keep the id, not the instance
+    other_id = other.id
+
+    # Mark received messages as read with one conditional UPDATE. Polls
+    # with nothing unread (the common case) stop at the conversation's
+    # counter: no write lock, no write transaction.
+    now = datetime.utcnow()
+    read_ids = []
+    if await unread_count(session, current_user.id, other_id):
+        async with serialized_writes():
+            res = await session.execute(
+                update(PrivateMessage)
+                .where(
+                    PrivateMessage.receiver_id == current_user.id,
+                    PrivateMessage.sender_id == other_id,
+                    PrivateMessage.read_at.is_(None),
                 )
+                .values(read_at=now)
+                .returning(PrivateMessage.id)
+                .execution_options(synchronize_session=False)
             )
-            .order_by(PrivateMessage.created_at.asc())
-            .limit(limit)
+            read_ids = res.scalars().all()
+            if read_ids:
+                unread = await record_read(
+                    session, current_user.id, other_id, len(read_ids)
+                )
+                await session.commit()
+            else:
+                await session.rollback()
+
+    # Keyset pagination on (created_at, id). An OR of both directions cannot
+    # be read from an index in order, so each direction is its own range
+    # scan of ix_privatemessage_pair_created_id, limited before the merge:
+    # a page reads at most 2 * limit rows however long the conversation is.
+    if after_id is not None:
+        cursor_id, newer = after_id, True
+    else:
+        cursor_id, newer = before_id, False
+    if newer:
+        order = (PrivateMessage.created_at.asc(), PrivateMessage.id.asc())
+    else:
+        # newest page first, flipped back to chronological order below
+        order = (PrivateMessage.created_at.desc(), PrivateMessage.id.desc())
+    if cursor_id is not None:
+        cursor = (
+            select(PrivateMessage.created_at)
+            .where(PrivateMessage.id == cursor_id)
+            .scalar_subquery()
         )
-        messages = q.scalars().all()
-
-        # Mark received messages as read
-        updated = False
-        now = datetime.utcnow()
-        for m in messages:
-            if m.receiver_id == current_user.id and m.read_at is None:
-                m.read_at = now
-                session.add(m)
-                updated = True
-        if updated:
-            await session.commit()
+        if newer:
+            after_cursor = and_(
+                PrivateMessage.created_at >= cursor,
+                or_(PrivateMessage.created_at > cursor, PrivateMessage.id > cursor_id),
+            )
+        else:
+            after_cursor = and_(
+                PrivateMessage.created_at <= cursor,
+                or_(PrivateMessage.created_at < cursor, PrivateMessage.id < cursor_id),
+            )
+
+    def direction(sender_id: int, receiver_id: int):
+        # plain column tuples: no ORM identity map work for a read-only page
+        q = select(*MESSAGE_COLUMNS).where(
+            PrivateMessage.sender_id == sender_id,
+            PrivateMessage.receiver_id == receiver_id,
+        )
+        if cursor_id is not None:
+            q = q.where(after_cursor)
+        return select(q.order_by(*order).limit(limit).subquery())
+
+    page = union_all(
+        direction(current_user.id, other_id), direction(other_id, current_user.id)
+    ).subquery("page")
+    if newer:
+        page_order = (page.c.created_at.asc(), page.c.id.asc())
+    else:
+        page_order = (page.c.created_at.desc(), page.c.id.desc())
+    res = await session.execute(select(*page.c).order_by(*page_order).limit(limit))
+    messages = res.all()
+    if not newer:
+        messages = list(reversed(messages))
 
-        return [
+    if read_ids:
+        # read receipts go to the sender and to the reader's other tabs
+        await manager.send_to_users(
+            [other_id, current_user.id],
             {
-                "id": m.id,
-                "sender_id": m.sender_id,
-                "receiver_id": m.receiver_id,
-                "content": m.content,
-                "created_at": m.created_at,
-                "read_at": m.read_at,
-            }
-            for m in messages
-        ]
+                "type": "read",
+                "reader_id": current_user.id,
+                "sender_id": other_id,
+                "message_ids": read_ids,
+                "read_at": now,
+                # the reader's badge for this sender, for their other tabs
+                "unread": unread,
+            },
+        )
+
+    return FastJSONResponse(message_rows(messages))
+
+
+FTS_TABLE = table("privatemessage_fts", column("rowid"))
+
 
+def fts5_query(q: str) -> str:
+    # every word quoted: user input is matched literally, never parsed as
+    # FTS5 syntax, and words are ANDed like websearch_to_tsquery does
+    return " ".join('"' + word.replace('"', '""') + '"' for word in q.split())
+
+
+@app.get("/search")
+async def search_messages(
+    q: str = Query(..., min_length=1, max_length=200),
+    with_user: Optional[str] = Query(None, alias="with"),
+    cursor: Optional[str] = Query(None),
+    limit: int = Query(20, ge=1, le=100),
+    current_user: User = Depends(get_current_user),
+    session: AsyncSession = Depends(get_session),
+):
+    me = current_user.id
+    peer_id = case(
+        (PrivateMessage.sender_id == me, PrivateMessage.receiver_id),
+        else_=PrivateMessage.sender_id,
+    )
+    if IS_SQLITE:
+        match = fts5_query(q)
+        if not match:
+            return {"results": [], "next_cursor": None}
+        # FTS5 index kept in sync by triggers (see migrations.py); bm25 is
+        # lower-is-better, negated so both backends rank descending
+        fts = literal_column("privatemessage_fts")
+        matches = (
+            select(
+                *MESSAGE_COLUMNS,
+                peer_id.label("peer_id"),
+                (-func.bm25(fts)).label("rank"),
+            )
+            .join(FTS_TABLE, FTS_TABLE.c.rowid == PrivateMessage.id)
+            .where(fts.op("MATCH")(match))
+        )
+    else:
+        search_vector = literal_column("privatemessage.search_vector")
+        query = func.websearch_to_tsquery(SEARCH_CONFIG, q)
+        matches = select(
+            *MESSAGE_COLUMNS,
+            peer_id.label("peer_id"),
+            func.ts_rank(search_vector, query).label("rank"),
+        ).where(search_vector.op("@@")(query))
+    # only conversations the caller is part of
+    if with_user:
+        other = await get_user_by_username(session, with_user)
+        if not other:
+            raise HTTPException(status_code=404, detail="User not found")
+        matches = matches.where(
+            or_(
+                and_(
+                    PrivateMessage.sender_id == me,
+                    PrivateMessage.receiver_id == other.id,
+                ),
+                and_(
+                    PrivateMessage.sender_id == other.id,
+                    PrivateMessage.receiver_id == me,
+                ),
+            )
+        )
+    else:
+        matches = matches.where(
+            or_(PrivateMessage.sender_id == me, PrivateMessage.receiver_id == me)
+        )
+    ranked = matches.subquery()
 
-@app.post("/messages/{username}")
+    stmt = select(ranked, User.username).join(User, User.id == ranked.c.peer_id)
+    # keyset pagination on (rank, id), both descending
+    if cursor:
+        try:
+            rank_str, _, id_str = cursor.partition(":")
+            after_rank, after_id = float(rank_str), int(id_str)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        stmt = stmt.where(
+            or_(
+                ranked.c.rank < after_rank,
+                and_(ranked.c.rank == after_rank, ranked.c.id < after_id),
+            )
+        )
+    stmt = stmt.order_by(ranked.c.rank.desc(), ranked.c.id.desc()).limit(limit)
+    rows = (await session.execute(stmt)).all()
+
+    results = [
+        {
+            "id": row.id,
+            "sender_id": row.sender_id,
+            "receiver_id": row.receiver_id,
+            "content": row.content,
+            "created_at": row.created_at,
+            "read_at": row.read_at,
+            "peer": row.username,
+            "rank": row.rank,
+        }
+        for row in rows
+    ]
+    next_cursor = None
+    if len(rows) == limit:
+        next_cursor = f"{rows[-1].rank!r}:{rows[-1].id}"
+    return {"results": results, "next_cursor": next_cursor}
+
+
+@app.post("/messages/{username}", dependencies=[Depends(limit_ip("send_ip"))])
 async def send_message(
     username: str,
     content: str = Form(...),
     current_user: User = Depends(get_current_user),
+    session: AsyncSession = Depends(get_session),
 ):
+    LIMITS["send_user"].check(current_user.id)
     content = (content or "").strip()
     if not content:
         raise HTTPException(status_code=400, detail="Message cannot be empty")
     if len(content) > 2000:
         raise HTTPException(status_code=400, detail="Message too long")
-    async with async_session() as session:
-        other = await get_user_by_username(session, username)
-        if not other:
-            raise HTTPException(status_code=404, detail="User not found")
-        msg = PrivateMessage(
-            sender_id=current_user.id, receiver_id=other.id, content=content
-        )
-        session.add(msg)
-        await session.commit()
-        await session.refresh(msg)
-        return {
-            "id": msg.id,
-            "sender_id": msg.sender_id,
-            "receiver_id": msg.receiver_id,
-            "content": msg.content,
-            "created_at": msg.created_at,
-            "read_at": msg.read_at,
-        }
+    other = await get_user_by_username(session, username)
+    if not other:
+        raise HTTPException(status_code=404, detail="User not found")
+    msg = PrivateMessage(
+        sender_id=current_user.id, receiver_id=other.id, content=content
+    )
+    if message_batcher is not None:
+        # hand the request's connection back first: the batcher writes on a
+        # connection of its own from the same pool
+        await session.close()
+        msg, unread = await message_batcher.submit(msg)
+    else:
+        async with serialized_writes():
+            session.add(msg)
+            await session.flush()
+            unread = await record_message(session, msg)
+            await session.commit()
+    payload = message_payload(msg)
+    # "unread" is the receiver's new badge count for this sender
+    await manager.send_to_users(
+        [msg.sender_id, msg.receiver_id],
+        {"type": "message", "message": payload, "unread": unread},
+    )
+    return payload
+
+
+async def get_admin_user(current_user: User = Depends(get_current_user)):
+    if current_user.username not in ADMIN_USERNAMES:
+        raise HTTPException(status_code=403, detail="Not allowed")
+    return current_user
+
+
+@app.get("/admin/stats")
+async def admin_stats(admin: User = Depends(get_admin_user)):
+    return {"db_pool": pool_status(), "metrics": metrics.snapshot()}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics(
+    authorization: Optional[str] = Header(None, alias="Authorization")
+):
+    if METRICS_TOKEN and authorization != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 
 from fastapi.responses import JSONResponse
@@ -410,8 +972,65 @@ async def logout():
     return response
 
 
+def parse_timestamp(value) -> Optional[datetime]:
+    # ISO 8601 as sent by browsers ("...Z") or by the server itself (naive UTC)
+    if not isinstance(value, str):
+        return None
+    try:
+        ts = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts
+
+
+async def resume(websocket: WebSocket, user_id: int, frame: dict):
+    """Replay the messages a reconnecting client missed, in one query.
+
+    The client sends ``{"type": "resume", "last_id": N, "since": ts}``: the
+    highest message id it has seen and when (server time) it last had a
+    live socket. The time bound keeps the scan on the newest partitions and
+    index ranges; the id bound drops what the client already has.
+    """
+    since = parse_timestamp(frame.get("since"))
+    try:
+        last_id = int(frame.get("last_id") or 0)
+    except (TypeError, ValueError):
+        last_id = 0
+    if since is None:
+        # nothing to anchor the scan to; let the client reload its views
+        manager.send_local(websocket, RESYNC)
+        return
+    async with async_session() as session:
+        q = await session.execute(
+            select(*MESSAGE_COLUMNS)
+            .where(
+                or_(
+                    PrivateMessage.receiver_id == user_id,
+                    PrivateMessage.sender_id == user_id,
+                ),
+                PrivateMessage.created_at >= since - RESUME_CLOCK_SKEW,
+                PrivateMessage.id > last_id,
+            )
+            .order_by(PrivateMessage.id)
+            .limit(WS_RESUME_LIMIT + 1)
+        )
+        missed = q.all()
+    if len(missed) > WS_RESUME_LIMIT:
+        manager.send_local(websocket, RESYNC)
+        return
+    manager.send_local(
+        websocket, Frame({"type": "messages", "messages": message_rows(missed)})
+    )
+
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket, token: Optional[str] = None):
+    if LIMITS["ws_connect_ip"].hit(client_ip(websocket)):
+        # closing before accept rejects the handshake
+        await websocket.close(code=1013)
+        return
     # token expected as query param: /ws?token=... or from cookies (HttpOnly) sent automatically
     if not token:
         # try to read from query params
@@ -435,17 +1054,68 @@ async def websocket_endpoint(websocket: WebSocket, token: Optional[str] = None):
     except Exception:
         await websocket.close(code=1008)
         return
+    if not username:
+        await websocket.close(code=1008)
+        return
+    async with async_session() as session:
+        user = await get_user_by_username(session, username)
+    if not user:
+        await websocket.close(code=1008)
+        return
 
-    await manager.connect(websocket)
+    # Registered before any resume query runs, so nothing published in
+    # between is lost; the client drops duplicates by message id
+    client = await manager.connect(websocket, user.id)
+    # presence needs heartbeats, which only typed-protocol clients send
+    tracked = client.protocol is not wsproto.LEGACY
+    if tracked:
+        presence.join(client, user.id)
+        manager.send_local(
+            websocket,
+            Frame({"type": "hello", "server_time": datetime.utcnow().isoformat()}),
+        )
     try:
         while True:
-            data = await websocket.receive_text()
-            await manager.broadcast(f"{username}: {data}")
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            if tracked:
+                presence.touch(client)
+            if LIMITS["ws_frames_user"].hit(user.id):
+                await websocket.close(code=WS_CLOSE_RATE_LIMITED)
+                break
+            event = wsproto.decode(message)
+            if event is None:
+                # plain text line from the original public chat page
+                if message.get("text"):
+                    await manager.broadcast(f"{username}: {message['text']}")
+            elif event["type"] == "chat" and isinstance(event.get("text"), str):
+                await manager.broadcast(f"{username}: {event['text']}")
+            elif not tracked or event["type"] == "ping":
+                pass
+            elif event["type"] == "resume":
+                await resume(websocket, user.id, event)
+            elif event["type"] == "watch" and isinstance(event.get("users"), list):
+                presence.watch(client, event["users"])
+            elif event["type"] == "typing":
+                presence.typed(user.id, event.get("to"))
     except WebSocketDisconnect:
+        pass
+    finally:
+        if tracked:
+            presence.leave(client)
         manager.disconnect(websocket)
 
 
 if __name__ == "__main__":
     import uvicorn
 
-    uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=True)
+    # permessage-deflate (uvicorn's default, spelled out) compresses frames
+    # for clients that offer it
+    uvicorn.run(
+        "main:app",
+        host="127.0.0.1",
+        port=8000,
+        reload=True,
+        ws_per_message_deflate=True,
+    )
@@ -0,0 +1,392 @@
+"""Versioned schema migrations.
+
+Each migration runs once, in its own transaction, and records its version in
+``schema_version``. Apply them out of band, before starting new workers::
+
+    python migrations.py upgrade
+    python migrations.py status
+
+Workers only compare the stored version with :data:`LATEST` on startup.
+The early migrations use IF NOT EXISTS throughout, so databases created
+before this table existed upgrade from version 0 in place.
+
+Migrations spell out their DDL instead of deriving it from ``models.py``:
+what a version creates must not change when the models do.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+from datetime import datetime
+from typing import Awaitable, Callable, List, NamedTuple, Optional
+
+from sqlalchemy import inspect, text
+
+import partitions
+from db import SEARCH_CONFIG, engine
+
+logger = logging.getLogger(__name__)
+
+# Apply pending migrations on worker startup instead of refusing to start;
+# convenient for local development, not meant for production deploys.
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", "") == "1"
+
+# How often running workers create upcoming message partitions
+PARTITION_CHECK_INTERVAL = float(os.getenv("PARTITION_CHECK_INTERVAL", "3600"))
+
+# Arbitrary key for the advisory lock serializing concurrent upgrades
+_LOCK_KEY = 7310021
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    apply: Callable[..., Awaitable[None]]
+
+
+MIGRATIONS: List[Migration] = []
+
+
+def migration(version: int, description: str):
+    def register(fn):
+        assert not MIGRATIONS or MIGRATIONS[-1].version == version - 1
+        MIGRATIONS.append(Migration(version, description, fn))
+        return fn
+
+    return register
+
+
+class SchemaOutOfDate(RuntimeError):
+    pass
+
+
+async def _has_column(conn, table: str, name: str) -> bool:
+    columns = await conn.run_sync(
+        lambda sync_conn: inspect(sync_conn).get_columns(table)
+    )
+    return any(column["name"] == name for column in columns)
+
+
+def _initial_sql(dialect: str) -> List[str]:
+    # the schema as of this migration, frozen; later changes go in new steps
+    if dialect == "postgresql":
+        serial, timestamp = "SERIAL", "TIMESTAMP WITHOUT TIME ZONE"
+    else:
+        serial, timestamp = "INTEGER", "DATETIME"
+    statements = [
+        'CREATE TABLE IF NOT EXISTS "user" ('
+        f"id {serial} NOT NULL, "
+        "username VARCHAR NOT NULL, "
+        "hashed_password VARCHAR NOT NULL, "
+        "first_name VARCHAR, "
+        "last_name VARCHAR, "
+        "bio VARCHAR, "
+        f"created_at {timestamp} NOT NULL, "
+        "is_active BOOLEAN NOT NULL, "
+        "PRIMARY KEY (id))",
+        'CREATE UNIQUE INDEX IF NOT EXISTS ix_user_username ON "user" (username)',
+        "CREATE TABLE IF NOT EXISTS conversation ("
+        "user_a_id INTEGER NOT NULL, "
+        "user_b_id INTEGER NOT NULL, "
+        "last_message_id INTEGER, "
+        f"last_activity_at {timestamp} NOT NULL, "
+        "unread_a INTEGER NOT NULL, "
+        "unread_b INTEGER NOT NULL, "
+        "PRIMARY KEY (user_a_id, user_b_id), "
+        'FOREIGN KEY (user_a_id) REFERENCES "user" (id), '
+        'FOREIGN KEY (user_b_id) REFERENCES "user" (id))',
+        "CREATE INDEX IF NOT EXISTS ix_conversation_user_a_activity "
+        "ON conversation (user_a_id, last_activity_at)",
+        "CREATE INDEX IF NOT EXISTS ix_conversation_user_b_activity "
+        "ON conversation (user_b_id, last_activity_at)",
+    ]
+    if dialect == "postgresql":
+        # privatemessage is partitioned there, see partitions.create_parent_sql
+        return statements
+    return statements + [
+        "CREATE TABLE IF NOT EXISTS privatemessage ("
+        "id INTEGER NOT NULL, "
+        "sender_id INTEGER NOT NULL, "
+        "receiver_id INTEGER NOT NULL, "
+        "content VARCHAR(2000) NOT NULL, "
+        f"created_at {timestamp} NOT NULL, "
+        f"read_at {timestamp}, "
+        "PRIMARY KEY (id), "
+        'FOREIGN KEY (sender_id) REFERENCES "user" (id), '
+        'FOREIGN KEY (receiver_id) REFERENCES "user" (id))',
+        "CREATE INDEX IF NOT EXISTS ix_privatemessage_receiver_id "
+        "ON privatemessage (receiver_id)",
+        "CREATE INDEX IF NOT EXISTS ix_privatemessage_pair_created_id "
+        "ON privatemessage (sender_id, receiver_id, created_at, id)",
+        "CREATE INDEX IF NOT EXISTS ix_privatemessage_unread "
+        "ON privatemessage (receiver_id, sender_id) WHERE read_at IS NULL",
+    ]
+
+
+@migration(1, "initial tables, partitioned privatemessage")
+async def _initial(conn) -> None:
+    for statement in _initial_sql(conn.dialect.name):
+        await conn.execute(text(statement))
+    if conn.dialect.name != "postgresql":
+        # no partitioning elsewhere
+        return
+    if not await partitions.table_exists(conn, partitions.PARENT):
+        await partitions.create_parent(conn, SEARCH_CONFIG)
+    await partitions.ensure_partitions(conn)
+
+
+@migration(2, "privatemessage.read_at")
+async def _read_at(conn) -> None:
+    if not await _has_column(conn, "privatemessage", "read_at"):
+        await conn.execute(
+            text("ALTER TABLE privatemessage ADD COLUMN read_at TIMESTAMP")
+        )
+
+
+@migration(3, "composite and partial message indexes, username prefix index")
+async def _indexes(conn) -> None:
+    # single-column indexes superseded by the composite/partial ones
+    for name in ("sender_id", "created_at", "read_at"):
+        await conn.execute(text(f"DROP INDEX IF EXISTS ix_privatemessage_{name}"))
+    await conn.execute(
+        text(
+            "CREATE INDEX IF NOT EXISTS ix_privatemessage_pair_created_id "
+            "ON privatemessage (sender_id, receiver_id, created_at, id)"
+        )
+    )
+    await conn.execute(
+        text(
+            "CREATE INDEX IF NOT EXISTS ix_privatemessage_unread "
+            "ON privatemessage (receiver_id, sender_id) WHERE read_at IS NULL"
+        )
+    )
+    # lets the sidebar's prefix search use an index regardless of collation
+    # (SQLite uses the unique index, with case_sensitive_like set in db.py)
+    if conn.dialect.name == "postgresql":
+        await conn.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS ix_user_username_pattern "
+                'ON "user" (username varchar_pattern_ops)'
+            )
+        )
+
+
+@migration(4, "backfill conversation summaries")
+async def _conversations(conn) -> None:
+    await conn.execute(
+        text(
+            "INSERT INTO conversation "
+            "(user_a_id, user_b_id, last_message_id, last_activity_at, "
+            "unread_a, unread_b) "
+            "SELECT user_a_id, user_b_id, MAX(id), MAX(created_at), "
+            "SUM(CASE WHEN read_at IS NULL AND receiver_id = user_a_id "
+            "THEN 1 ELSE 0 END), "
+            "SUM(CASE WHEN read_at IS NULL AND receiver_id = user_b_id "
+            "THEN 1 ELSE 0 END) "
+            "FROM (SELECT *, "
+            "CASE WHEN sender_id < receiver_id THEN sender_id "
+            "ELSE receiver_id END AS user_a_id, "
+            "CASE WHEN sender_id < receiver_id THEN receiver_id "
+            "ELSE sender_id END AS user_b_id "
+            "FROM privatemessage) AS m "
+            "WHERE NOT EXISTS (SELECT 1 FROM conversation) "
+            "GROUP BY user_a_id, user_b_id"
+        )
+    )
+
+
+@migration(5, "full-text search vector and GIN index")
+async def _search(conn) -> None:
+    if conn.dialect.name == "sqlite":
+        await _search_sqlite(conn)
+        return
+    # a generated tsvector kept in sync by Postgres, indexed with GIN so
+    # /search never scans the table
+    await conn.execute(
+        text(
+            "ALTER TABLE privatemessage ADD COLUMN IF NOT EXISTS search_vector "
+            f"tsvector GENERATED ALWAYS AS (to_tsvector('{SEARCH_CONFIG}', "
+            "content)) STORED"
+        )
+    )
+    await conn.execute(
+        text(
+            "CREATE INDEX IF NOT EXISTS ix_privatemessage_search "
+            "ON privatemessage USING GIN (search_vector)"
+        )
+    )
+
+
+async def _search_sqlite(conn) -> None:
+    # external-content FTS5 table: only the index is stored, the text stays
+    # in privatemessage; triggers keep the two in step
+    statements = [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS privatemessage_fts USING fts5("
+        "content, content='privatemessage', content_rowid='id')",
+        "CREATE TRIGGER IF NOT EXISTS privatemessage_fts_insert "
+        "AFTER INSERT ON privatemessage BEGIN "
+        "INSERT INTO privatemessage_fts (rowid, content) "
+        "VALUES (new.id, new.content); END",
+        "CREATE TRIGGER IF NOT EXISTS privatemessage_fts_delete "
+        "AFTER DELETE ON privatemessage BEGIN "
+        "INSERT INTO privatemessage_fts (privatemessage_fts, rowid, content) "
+        "VALUES ('delete', old.id, old.content); END",
+        "CREATE TRIGGER IF NOT EXISTS privatemessage_fts_update "
+        "AFTER UPDATE OF content ON privatemessage BEGIN "
+        "INSERT INTO privatemessage_fts (privatemessage_fts, rowid, content) "
+        "VALUES ('delete', old.id, old.content); "
+        "INSERT INTO privatemessage_fts (rowid, content) "
+        "VALUES (new.id, new.content); END",
+        # index whatever was written before the table existed
+        "INSERT INTO privatemessage_fts (privatemessage_fts) VALUES ('rebuild')",
+    ]
+    for statement in statements:
+        await conn.execute(text(statement))
+
+
+@migration(6, "lower(first_name) and lower(last_name) prefix indexes")
+async def _name_indexes(conn) -> None:
+    # the sidebar search ORs three prefix matches; with these each one is an
+    # index range scan (BitmapOr on Postgres, MULTI-INDEX OR on SQLite)
+    opclass = " varchar_pattern_ops" if conn.dialect.name == "postgresql" else ""
+    for column in ("first_name", "last_name"):
+        await conn.execute(
+            text(
+                f"CREATE INDEX IF NOT EXISTS ix_user_{column}_pattern "
+                f'ON "user" (lower({column}){opclass})'
+            )
+        )
+
+
+LATEST = MIGRATIONS[-1].version
+
+
+async def current_version(conn) -> int:
+    """Highest applied version; 0 for a database never migrated."""
+    has_table = await conn.run_sync(
+        lambda sync_conn: inspect(sync_conn).has_table("schema_version")
+    )
+    if not has_table:
+        return 0
+    res = await conn.execute(text("SELECT MAX(version) FROM schema_version"))
+    return res.scalar() or 0
+
+
+async def _lock(conn) -> None:
+    # held until the transaction ends, so two deploys never interleave
+    if conn.dialect.name == "postgresql":
+        await conn.execute(
+            text("SELECT pg_advisory_xact_lock(:key)"), {"key": _LOCK_KEY}
+        )
+
+
+async def upgrade(target: Optional[int] = None) -> List[int]:
+    """Apply every pending migration up to ``target``; returns what ran."""
+    target = LATEST if target is None else target
+    applied = []
+    async with engine.begin() as conn:
+        await conn.execute(
+            text(
+                "CREATE TABLE IF NOT EXISTS schema_version ("
+                "version INTEGER PRIMARY KEY, "
+                "description VARCHAR(200) NOT NULL, "
+                "applied_at TIMESTAMP NOT NULL)"
+            )
+        )
+    for step in MIGRATIONS:
+        if step.version > target:
+            break
+        async with engine.begin() as conn:
+            await _lock(conn)
+            if await current_version(conn) >= step.version:
+                continue
+            await step.apply(conn)
+            await conn.execute(
+                text(
+                    "INSERT INTO schema_version (version, description, applied_at) "
+                    "VALUES (:version, :description, :applied_at)"
+                ),
+                {
+                    "version": step.version,
+                    "description": step.description,
+                    "applied_at": datetime.utcnow(),
+                },
+            )
+        applied.append(step.version)
+    if target >= 1:
+        # upcoming months, also available as `python partitions.py ensure`
+        async with engine.begin() as conn:
+            await partitions.ensure_partitions(conn)
+    return applied
+
+
+async def check_schema() -> None:
+    """Startup check: reads schema_version only, never takes DDL locks."""
+    async with engine.connect() as conn:
+        version = await current_version(conn)
+    if version >= LATEST:
+        # a newer schema is fine: migrations stay compatible with the
+        # previous release so rolling deploys can migrate first
+        return
+    if AUTO_MIGRATE:
+        await upgrade()
+        return
+    raise SchemaOutOfDate(
+        f"database schema is at version {version}, this code needs {LATEST}; "
+        "run `python migrations.py upgrade` (or set AUTO_MIGRATE=1)"
+    )
+
+
+async def maintain_partitions(interval: float = PARTITION_CHECK_INTERVAL) -> None:
+    """Worker background task: keep upcoming message partitions created.
+
+    Checks the catalog first and only takes the upgrade lock when a month
+    is missing; a worker that finds the lock taken leaves it to the holder.
+    """
+    while True:
+        try:
+            async with engine.connect() as conn:
+                missing = await partitions.missing_partitions(
+                    conn, partitions.PARTITION_MONTHS_AHEAD
+                )
+            if missing:
+                async with engine.begin() as conn:
+                    res = await conn.execute(
+                        text("SELECT pg_try_advisory_xact_lock(:key)"),
+                        {"key": _LOCK_KEY},
+                    )
+                    if res.scalar():
+                        # never queue behind traffic on privatemessage for long
+                        await conn.execute(text("SET LOCAL lock_timeout = '5s'"))
+                        await partitions.ensure_partitions(conn)
+        except Exception:
+            logger.exception("Creating message partitions failed")
+        await asyncio.sleep(interval)
+
+
+async def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    up = sub.add_parser("upgrade", help="apply pending migrations")
+    up.add_argument("--to", type=int, metavar="VERSION", help=f"default: {LATEST}")
+    sub.add_parser("status", help="show applied and pending migrations")
+    args = parser.parse_args(argv)
+
+    if args.command == "upgrade":
+        applied = await upgrade(args.to)
+        for version in applied:
+            print(f"applied {version}: {MIGRATIONS[version - 1].description}")
+        if not applied:
+            print("nothing to apply")
+    else:
+        async with engine.connect() as conn:
+            version = await current_version(conn)
+        for step in MIGRATIONS:
+            state = "applied" if step.version <= version else "pending"
+            print(f"{step.version:>3}  {state:<8} {step.description}")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
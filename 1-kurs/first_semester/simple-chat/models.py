@@ -1,6 +1,7 @@
 from datetime import datetime
 from typing import Optional
 
+from sqlalchemy import Index, text
 from sqlmodel import Field, SQLModel
 
 
@@ -16,9 +17,48 @@ class User(SQLModel, table=True):
 
 
 class PrivateMessage(SQLModel, table=True):
+    __table_args__ = (
+        # serves keyset pagination of one direction of a conversation
+        Index(
+            "ix_privatemessage_pair_created_id",
+            "sender_id",
+            "receiver_id",
+            "created_at",
+            "id",
+        ),
+        # unread messages per receiver, grouped by sender for the sidebar
+        Index(
+            "ix_privatemessage_unread",
+            "receiver_id",
+            "sender_id",
+            postgresql_where=text("read_at IS NULL"),
+            sqlite_where=text("read_at IS NULL"),
+        ),
+    )
+
+    # On Postgres the table is range-partitioned by month on created_at (see
+    # partitions.py), so the real primary key there is (id, created_at).
+    # sender_id and created_at lookups go through the pair index above and
+    # read_at through the partial unread index.
     id: Optional[int] = Field(default=None, primary_key=True)
-    sender_id: int = Field(index=True, nullable=False, foreign_key="user.id")
+    sender_id: int = Field(nullable=False, foreign_key="user.id")
     receiver_id: int = Field(index=True, nullable=False, foreign_key="user.id")
     content: str = Field(nullable=False, max_length=2000)
-    created_at: datetime = Field(default_factory=datetime.utcnow, index=True)
-    read_at: Optional[datetime] = Field(default=None, index=True)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    read_at: Optional[datetime] = Field(default=None)
+
+
+class Conversation(SQLModel, table=True):
+    # One row per pair of users, stored with user_a_id < user_b_id; the
+    # unread_* counters hold what each side has not read yet.
+    __table_args__ = (
+        Index("ix_conversation_user_a_activity", "user_a_id", "last_activity_at"),
+        Index("ix_conversation_user_b_activity", "user_b_id", "last_activity_at"),
+    )
+
+    user_a_id: int = Field(primary_key=True, foreign_key="user.id")
+    user_b_id: int = Field(primary_key=True, foreign_key="user.id")
+    last_message_id: Optional[int] = Field(default=None)
+    last_activity_at: datetime = Field(default_factory=datetime.utcnow)
+    unread_a: int = Field(default=0, nullable=False)
+    unread_b: int = Field(default=0, nullable=False)
@@ -0,0 +1,119 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+from typing import Dict, Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+
+try:  # optional: brotli variants are only built when the package is installed
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+STATIC_DIR = "static"
+# Re-read files whose mtime changed; meant for local development only
+CHAT_DEV = os.getenv("CHAT_DEV", "") == "1"
+STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE", "0"))  # seconds
+# Bodies smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 256
+COMPRESSIBLE = ("text/", "application/javascript", "application/json", "image/svg")
+
+
+class CachedFile:
+    __slots__ = ("path", "mtime", "media_type", "variants")
+
+    def __init__(self, path: str):
+        self.path = path
+        self.mtime = os.path.getmtime(path)
+        self.media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        with open(path, "rb") as f:
+            body = f.read()
+        digest = hashlib.sha1(body).hexdigest()[:20]
+        # encoding -> (etag, body); each encoding gets its own strong ETag
+        self.variants: Dict[str, tuple] = {"identity": (f'"{digest}"', body)}
+        if len(body) >= MIN_COMPRESS_SIZE and self.media_type.startswith(COMPRESSIBLE):
+            self.variants["gzip"] = (
+                f'"{digest}-gz"',
+                gzip.compress(body, compresslevel=9, mtime=0),
+            )
+            if brotli is not None:
+                self.variants["br"] = (
+                    f'"{digest}-br"',
+                    brotli.compress(body, quality=11),
+                )
+
+
+def _accepted_encodings(header: str) -> set:
+    accepted = set()
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        params = params.replace(" ", "")
+        if params in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(name.strip().lower())
+    return accepted
+
+
+class FileCache:
+    """Files under ``root`` held in memory with precompressed variants."""
+
+    def __init__(self, root: str = STATIC_DIR, dev: bool = CHAT_DEV):
+        self.root = os.path.abspath(root)
+        self.dev = dev
+        self.files: Dict[str, CachedFile] = {}
+
+    def preload(self) -> None:
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                self.files[path] = CachedFile(path)
+
+    def get(self, relpath: str) -> Optional[CachedFile]:
+        path = os.path.abspath(os.path.join(self.root, relpath))
+        if not path.startswith(self.root + os.sep):
+            return None
+        cached = self.files.get(path)
+        if cached is not None and not self.dev:
+            return cached
+        if not os.path.isfile(path):
+            self.files.pop(path, None)
+            return None
+        if cached is None or os.path.getmtime(path) != cached.mtime:
+            cached = self.files[path] = CachedFile(path)
+        return cached
+
+    def response(self, request: Request, relpath: str) -> Response:
+        cached = self.get(relpath)
+        if cached is None:
+            return Response(status_code=404)
+        accepted = _accepted_encodings(request.headers.get("accept-encoding", ""))
+        encoding = "identity"
+        for candidate in ("br", "gzip"):
+            if candidate in cached.variants and candidate in accepted:
+                encoding = candidate
+                break
+        etag, body = cached.variants[encoding]
+        headers = {
+            "ETag": etag,
+            "Vary": "Accept-Encoding",
+            "Cache-Control": (
+                f"public, max-age={STATIC_MAX_AGE}" if STATIC_MAX_AGE else "no-cache"
+            ),
+        }
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and (
+            if_none_match.strip() == "*"
+            or etag in (tag.strip() for tag in if_none_match.split(","))
+        ):
+            return Response(status_code=304, headers=headers)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        if request.method == "HEAD":
+            headers["Content-Length"] = str(len(body))
+            return Response(media_type=cached.media_type, headers=headers)
+        return Response(content=body, media_type=cached.media_type, headers=headers)
+
+
+page_cache = FileCache()
@@ -0,0 +1,283 @@
+"""Monthly range partitions of ``privatemessage`` (Postgres only).
+
+``migrations.py upgrade`` calls :func:`ensure_partitions`, and running workers
+repeat it every ``PARTITION_CHECK_INTERVAL`` (see
+``migrations.maintain_partitions``). Old months are handled out of band with
+this module's command line::
+
+    python partitions.py ensure
+    python partitions.py convert            # one-off, for pre-partitioning DBs
+    python partitions.py detach --older-than 12
+    python partitions.py export --older-than 12 --dir archive/
+"""
+
+import argparse
+import asyncio
+import gzip
+import os
+import re
+from datetime import date, datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text
+
+PARENT = "privatemessage"
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+DEFAULT_PARTITION = f"{PARENT}_default"
+
+EXPORT_COLUMNS = ["id", "sender_id", "receiver_id", "content", "created_at", "read_at"]
+
+_UPPER_BOUND = re.compile(r"TO \('([^']+)'\)")
+
+
+def month_start(day: date, offset: int = 0) -> date:
+    index = day.year * 12 + day.month - 1 + offset
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"{PARENT}_p{month.year:04d}_{month.month:02d}"
+
+
+def create_parent_sql(search_config: str) -> List[str]:
+    # Mirrors models.PrivateMessage as of migration 1 and stays frozen with
+    # it; the primary key has to include the partition key, and ids come from
+    # an explicit sequence so `convert` can keep numbering from the old table.
+    # Indexes on the parent cascade to every partition.
+    return [
+        f"CREATE SEQUENCE IF NOT EXISTS {PARENT}_id_seq",
+        f"""
+        CREATE TABLE {PARENT} (
+            id INTEGER NOT NULL DEFAULT nextval('{PARENT}_id_seq'),
+            sender_id INTEGER NOT NULL REFERENCES "user" (id),
+            receiver_id INTEGER NOT NULL REFERENCES "user" (id),
+            content VARCHAR(2000) NOT NULL,
+            created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            read_at TIMESTAMP WITHOUT TIME ZONE,
+            search_vector tsvector GENERATED ALWAYS AS
+                (to_tsvector('{search_config}', content)) STORED,
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+        """,
+        f"ALTER SEQUENCE {PARENT}_id_seq OWNED BY {PARENT}.id",
+        # catches rows outside every monthly range instead of failing inserts
+        f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF {PARENT} DEFAULT",
+        f"CREATE INDEX IF NOT EXISTS ix_{PARENT}_receiver_id "
+        f"ON {PARENT} (receiver_id)",
+        f"CREATE INDEX IF NOT EXISTS ix_{PARENT}_pair_created_id "
+        f"ON {PARENT} (sender_id, receiver_id, created_at, id)",
+        f"CREATE INDEX IF NOT EXISTS ix_{PARENT}_unread "
+        f"ON {PARENT} (receiver_id, sender_id) WHERE read_at IS NULL",
+    ]
+
+
+async def table_exists(conn, name: str) -> bool:
+    res = await conn.execute(
+        text("SELECT to_regclass(:name) IS NOT NULL"), {"name": name}
+    )
+    return bool(res.scalar())
+
+
+async def is_partitioned(conn) -> bool:
+    res = await conn.execute(
+        text(
+            "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table "
+            "WHERE partrelid = to_regclass(:name))"
+        ),
+        {"name": PARENT},
+    )
+    return bool(res.scalar())
+
+
+async def list_partitions(conn) -> List[Tuple[str, Optional[datetime]]]:
+    """(name, exclusive upper bound) of every attached partition."""
+    res = await conn.execute(
+        text(
+            "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) "
+            "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(:name) ORDER BY c.relname"
+        ),
+        {"name": PARENT},
+    )
+    partitions = []
+    for name, bound in res.all():
+        match = _UPPER_BOUND.search(bound or "")
+        upper = datetime.fromisoformat(match.group(1)) if match else None
+        partitions.append((name, upper))
+    return partitions
+
+
+async def create_parent(conn, search_config: str) -> None:
+    for statement in create_parent_sql(search_config):
+        await conn.execute(text(statement))
+
+
+async def missing_partitions(conn, months_ahead: int = 1) -> List[date]:
+    """Months from this one to ``months_ahead`` on that have no partition.
+
+    Read-only. Rows for a missing month land in the default partition, and
+    Postgres refuses to create a partition overlapping rows already there.
+    """
+    if conn.dialect.name != "postgresql" or not await is_partitioned(conn):
+        return []
+    existing = {name for name, _ in await list_partitions(conn)}
+    this_month = month_start(datetime.utcnow().date())
+    months = [month_start(this_month, offset) for offset in range(months_ahead + 1)]
+    return [month for month in months if partition_name(month) not in existing]
+
+
+async def ensure_partitions(conn, months_ahead: int = PARTITION_MONTHS_AHEAD) -> None:
+    """Create this month's partition and the next ``months_ahead`` ones."""
+    for start in await missing_partitions(conn, months_ahead):
+        await create_partition(conn, start)
+
+
+async def create_partition(conn, start: date) -> None:
+    """Create the partition for the month from ``start``.
+
+    Rows of that month already in the default partition (nobody created it
+    in time) would make Postgres refuse; they are moved into the new
+    partition with the default one detached meanwhile. That holds an
+    exclusive lock on privatemessage, but only for months that were missed.
+    """
+    name = partition_name(start)
+    end = month_start(start, 1)
+    create = (
+        f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {PARENT} "
+        f"FOR VALUES FROM ('{start}') TO ('{end}')"
+    )
+    in_month = f"created_at >= '{start}' AND created_at < '{end}'"
+    res = await conn.execute(
+        text(f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} WHERE {in_month})")
+    )
+    if not res.scalar():
+        await conn.execute(text(create))
+        return
+    columns = ", ".join(EXPORT_COLUMNS)  # search_vector is generated
+    for statement in (
+        f"ALTER TABLE {PARENT} DETACH PARTITION {DEFAULT_PARTITION}",
+        create,
+        f"INSERT INTO {name} ({columns}) "
+        f"SELECT {columns} FROM {DEFAULT_PARTITION} WHERE {in_month}",
+        f"DELETE FROM {DEFAULT_PARTITION} WHERE {in_month}",
+        f"ALTER TABLE {PARENT} ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT",
+    ):
+        await conn.execute(text(statement))
+
+
+async def convert(conn, search_config: str) -> None:
+    """Turn a plain privatemessage table into a partitioned one in place.
+
+    The old table becomes the partition for everything before the current
+    month; Postgres validates the range via the CHECK constraint added first.
+    """
+    if await is_partitioned(conn):
+        print(f"{PARENT} is already partitioned")
+        return
+    cutoff = month_start(datetime.utcnow().date())
+    legacy = f"{PARENT}_legacy"
+    await conn.execute(text(f"ALTER TABLE {PARENT} RENAME TO {legacy}"))
+    # free the index names for the new parent
+    res = await conn.execute(
+        text("SELECT indexname FROM pg_indexes WHERE tablename = :name"),
+        {"name": legacy},
+    )
+    for (index_name,) in res.all():
+        if legacy in index_name:
+            continue
+        new_name = index_name.replace(PARENT, legacy, 1)
+        if new_name != index_name:
+            await conn.execute(text(f"ALTER INDEX {index_name} RENAME TO {new_name}"))
+    # the legacy table's serial sequence keeps issuing ids for the new table
+    await conn.execute(text(f"ALTER SEQUENCE {PARENT}_id_seq OWNED BY NONE"))
+    await conn.execute(text(f"ALTER TABLE {legacy} ALTER COLUMN id DROP DEFAULT"))
+    await create_parent(conn, search_config)
+    await conn.execute(
+        text(
+            f"ALTER TABLE {legacy} ADD CONSTRAINT {legacy}_range "
+            f"CHECK (created_at IS NOT NULL AND created_at < '{cutoff}')"
+        )
+    )
+    await conn.execute(
+        text(
+            f"ALTER TABLE {PARENT} ATTACH PARTITION {legacy} "
+            f"FOR VALUES FROM (MINVALUE) TO ('{cutoff}')"
+        )
+    )
+    await ensure_partitions(conn)
+
+
+async def old_partitions(conn, older_than_months: int) -> List[str]:
+    cutoff = month_start(datetime.utcnow().date(), -older_than_months)
+    return [
+        name
+        for name, upper in await list_partitions(conn)
+        if upper is not None and upper.date() <= cutoff
+    ]
+
+
+async def detach(conn, names: List[str]) -> None:
+    for name in names:
+        await conn.execute(text(f"ALTER TABLE {PARENT} DETACH PARTITION {name}"))
+        print(f"detached {name}")
+
+
+async def export(conn, names: List[str], directory: str) -> None:
+    """Detach each partition, dump it to a gzipped CSV, then drop it."""
+    os.makedirs(directory, exist_ok=True)
+    raw = await conn.get_raw_connection()
+    driver = raw.driver_connection  # asyncpg, for COPY
+    for name in names:
+        await conn.execute(text(f"ALTER TABLE {PARENT} DETACH PARTITION {name}"))
+        path = os.path.join(directory, f"{name}.csv.gz")
+        with gzip.open(path, "wb") as out:
+
+            async def write(chunk: bytes) -> None:
+                out.write(chunk)
+
+            await driver.copy_from_table(
+                name,
+                columns=EXPORT_COLUMNS,
+                output=write,
+                format="csv",
+                header=True,
+            )
+        await conn.execute(text(f"DROP TABLE {name}"))
+        print(f"exported {name} to {path}")
+
+
+async def main(argv: Optional[List[str]] = None) -> None:
+    from db import SEARCH_CONFIG, engine
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("ensure", help="create upcoming monthly partitions")
+    sub.add_parser("convert", help="partition an existing privatemessage table")
+    for command in ("detach", "export"):
+        p = sub.add_parser(command, help=f"{command} partitions older than N months")
+        p.add_argument("--older-than", type=int, required=True, metavar="MONTHS")
+        if command == "export":
+            p.add_argument("--dir", default="archive")
+    args = parser.parse_args(argv)
+
+    if engine.dialect.name != "postgresql":
+        parser.exit(message="partitioning is only used on Postgres\n")
+
+    async with engine.begin() as conn:
+        if args.command == "ensure":
+            await ensure_partitions(conn)
+        elif args.command == "convert":
+            await convert(conn, SEARCH_CONFIG)
+        else:
+            names = await old_partitions(conn, args.older_than)
+            if not names:
+                print("nothing to archive")
+            elif args.command == "detach":
+                await detach(conn, names)
+            else:
+                await export(conn, names, args.dir)
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,238 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, Iterable, List, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Deltas are collected and sent once per tick, never per event
+PRESENCE_INTERVAL = float(os.getenv("PRESENCE_INTERVAL", "1"))  # seconds
+# A socket that has sent nothing (not even a ping) for this long is dropped
+PRESENCE_TTL = float(os.getenv("PRESENCE_TTL", "60"))  # seconds
+# Contacts one socket may watch; the sidebar page plus the open conversation
+WATCH_LIMIT = 200
+# Ids per backplane envelope, keeps each NOTIFY well under its size limit
+_CHUNK = 400
+
+
+class PresenceRegistry:
+    """Who is online or typing, with updates coalesced per tick.
+
+    Each worker counts its own sockets per user and tells the others about
+    transitions only (online/offline) plus the typing pairs seen in the
+    tick, in one envelope per tick. Every PRESENCE_TTL it republishes its
+    online users so a crashed worker's users expire elsewhere.
+
+    Sockets say which contacts they display (``watch``) and receive at most
+    one presence event per tick, covering only those contacts, so cost
+    grows with what people look at rather than with the user count.
+    """
+
+    def __init__(
+        self,
+        publish: Callable[[dict], Awaitable[None]],
+        deliver: Callable[[object, dict], None],
+        expire: Callable[[object], None],
+        interval: float = PRESENCE_INTERVAL,
+        ttl: float = PRESENCE_TTL,
+    ):
+        self.publish = publish
+        self.deliver = deliver  # (client, event) -> queue it on that socket
+        self.expire = expire  # (client) -> close a socket that went silent
+        self.interval = interval
+        self.ttl = ttl
+        self.worker_id = uuid.uuid4().hex[:12]
+        # local sockets: client -> (user id, last frame received)
+        self.clients: Dict[object, Tuple[int, float]] = {}
+        self.local: Dict[int, int] = {}  # user id -> open local sockets
+        self.remote: Dict[int, Dict[str, float]] = {}  # user -> {worker: expiry}
+        self.watching: Dict[object, Set[int]] = {}
+        self.watchers: Dict[int, Set[object]] = {}
+        # pending work for the next tick
+        self.changed: Set[int] = set()  # users whose status changed
+        self.transitions: Dict[int, bool] = {}  # local, to publish
+        self.typing: Set[Tuple[int, int]] = set()  # (typer, peer), to deliver
+        self.typing_out: Set[Tuple[int, int]] = set()  # local, to publish
+        self.task = None
+
+    def is_online(self, user_id: int) -> bool:
+        return user_id in self.local or user_id in self.remote
+
+    # --- local sockets
+
+    def join(self, client, user_id: int) -> None:
+        self.clients[client] = (user_id, time.monotonic())
+        count = self.local.get(user_id, 0)
+        if count == 0:
+            was_online = self.is_online(user_id)
+            self.transitions[user_id] = True
+            if not was_online:
+                self.changed.add(user_id)
+        self.local[user_id] = count + 1
+
+    def leave(self, client) -> None:
+        entry = self.clients.pop(client, None)
+        self.unwatch(client)
+        if entry is None:
+            return
+        user_id = entry[0]
+        count = self.local.get(user_id, 0) - 1
+        if count > 0:
+            self.local[user_id] = count
+            return
+        self.local.pop(user_id, None)
+        self.transitions[user_id] = False
+        if not self.is_online(user_id):
+            self.changed.add(user_id)
+
+    def touch(self, client) -> None:
+        entry = self.clients.get(client)
+        if entry is not None:
+            self.clients[client] = (entry[0], time.monotonic())
+
+    def watch(self, client, user_ids: Iterable[int]) -> None:
+        """Replace the contacts ``client`` displays; answers with a snapshot."""
+        self.unwatch(client)
+        ids = {u for u in user_ids if isinstance(u, int)}
+        ids = set(sorted(ids)[:WATCH_LIMIT])
+        self.watching[client] = ids
+        for user_id in ids:
+            self.watchers.setdefault(user_id, set()).add(client)
+        online = sorted(u for u in ids if self.is_online(u))
+        offline = sorted(ids.difference(online))
+        self.deliver(client, {"type": "presence", "online": online, "offline": offline})
+
+    def unwatch(self, client) -> None:
+        for user_id in self.watching.pop(client, ()):
+            watchers = self.watchers.get(user_id)
+            if watchers is not None:
+                watchers.discard(client)
+                if not watchers:
+                    del self.watchers[user_id]
+
+    def typed(self, user_id: int, peer_id) -> None:
+        if not isinstance(peer_id, int) or peer_id == user_id:
+            return
+        self.typing.add((user_id, peer_id))
+        self.typing_out.add((user_id, peer_id))
+
+    # --- other workers
+
+    def apply(self, envelope: dict) -> None:
+        """A presence envelope from the backplane."""
+        worker = envelope.get("worker")
+        if worker == self.worker_id:
+            return
+        expiry = time.monotonic() + 2 * self.ttl
+        for user_id in envelope.get("online", ()):
+            if not self.is_online(user_id):
+                self.changed.add(user_id)
+            self.remote.setdefault(user_id, {})[worker] = expiry
+        for user_id in envelope.get("offline", ()):
+            workers = self.remote.get(user_id)
+            if workers is not None:
+                workers.pop(worker, None)
+                if not workers:
+                    del self.remote[user_id]
+                    if not self.is_online(user_id):
+                        self.changed.add(user_id)
+        for typer, peer in envelope.get("typing", ()):
+            self.typing.add((typer, peer))
+
+    # --- ticks
+
+    async def start(self) -> None:
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self.task is None:
+            return
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+        if self.local:
+            await self._publish_ids("offline", sorted(self.local))
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        next_sweep = next_refresh = loop.time()
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                now = loop.time()
+                if now >= next_sweep:
+                    self._sweep()
+                    next_sweep = now + self.ttl / 4
+                await self._flush()
+                if now >= next_refresh:
+                    await self._publish_ids("online", sorted(self.local))
+                    next_refresh = now + self.ttl
+            except Exception:
+                logger.exception("Presence tick failed")
+
+    def _sweep(self) -> None:
+        now = time.monotonic()
+        for client, (_, last_seen) in list(self.clients.items()):
+            if now - last_seen > self.ttl:
+                self.expire(client)
+        for user_id, workers in list(self.remote.items()):
+            for worker, expiry in list(workers.items()):
+                if expiry < now:
+                    del workers[worker]
+            if not workers:
+                del self.remote[user_id]
+                if not self.is_online(user_id):
+                    self.changed.add(user_id)
+
+    async def _flush(self) -> None:
+        transitions, self.transitions = self.transitions, {}
+        typing_out, self.typing_out = self.typing_out, set()
+        if transitions or typing_out:
+            online = sorted(u for u, up in transitions.items() if up)
+            offline = sorted(u for u, up in transitions.items() if not up)
+            typing = sorted(typing_out)
+            longest = max(len(online), len(offline), len(typing))
+            for start in range(0, longest, _CHUNK):
+                await self.publish(
+                    {
+                        "kind": "presence",
+                        "worker": self.worker_id,
+                        "online": online[start : start + _CHUNK],
+                        "offline": offline[start : start + _CHUNK],
+                        "typing": [list(p) for p in typing[start : start + _CHUNK]],
+                    }
+                )
+        self._deliver_pending()
+
+    def _deliver_pending(self) -> None:
+        changed, self.changed = self.changed, set()
+        typing, self.typing = self.typing, set()
+        events: Dict[object, dict] = {}
+        for user_id in changed:
+            key = "online" if self.is_online(user_id) else "offline"
+            for client in self.watchers.get(user_id, ()):
+                event = events.setdefault(client, {"type": "presence"})
+                event.setdefault(key, []).append(user_id)
+        for typer, peer in typing:
+            # only the peer's sockets that have the typer open
+            for client in self.watchers.get(typer, ()):
+                if self.clients.get(client, (None,))[0] == peer:
+                    event = events.setdefault(client, {"type": "presence"})
+                    event.setdefault("typing", []).append(typer)
+        for client, event in events.items():
+            self.deliver(client, event)
+
+    async def _publish_ids(self, key: str, user_ids: List[int]) -> None:
+        for start in range(0, len(user_ids), _CHUNK):
+            await self.publish(
+                {
+                    "kind": "presence",
+                    "worker": self.worker_id,
+                    key: user_ids[start : start + _CHUNK],
+                }
+            )
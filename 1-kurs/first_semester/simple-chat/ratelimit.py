@@ -0,0 +1,128 @@
+import math
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from fastapi import HTTPException, Request, status
+
+from metrics import Counter
+
+# A limit is "<requests>/<period>", e.g. "30/10s" or "5/m": a bucket of that
+# many tokens, refilled evenly over the period. "0" or "off" disables it.
+_LIMIT = re.compile(r"^\s*(\d+)\s*/\s*(\d*\.?\d*)\s*([smh]?)\s*$")
+_UNITS = {"": 1, "s": 1, "m": 60, "h": 3600}
+
+# Keys (users or IPs) tracked per limiter before the least recent is evicted
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+
+rate_limited_total = Counter(
+    "rate_limited_total", "Requests and WebSocket frames refused by a rate limit"
+)
+
+
+def parse_limit(spec: str) -> Optional[Tuple[int, float]]:
+    """(capacity, period in seconds), or None when the limit is off."""
+    spec = spec.strip().lower()
+    if spec in ("", "0", "off"):
+        return None
+    match = _LIMIT.match(spec)
+    if not match:
+        raise ValueError(f"invalid rate limit {spec!r}, expected e.g. '30/10s'")
+    capacity = int(match.group(1))
+    period = float(match.group(2) or 1) * _UNITS[match.group(3)]
+    if capacity <= 0 or period <= 0:
+        return None
+    return capacity, period
+
+
+class RateLimiter:
+    """Token buckets keyed by user id or client IP.
+
+    Each key costs one (tokens, updated) pair. Keys are kept in last-use
+    order, so buckets idle long enough to be full again are dropped from the
+    front as new hits come in; a dropped key simply starts over with a full
+    bucket, which is exactly the state it was in.
+    """
+
+    def __init__(self, name: str, spec: str, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.name = name
+        limit = parse_limit(spec)
+        self.enabled = limit is not None
+        self.capacity, self.period = limit or (0, 0.0)
+        self.rate = self.capacity / self.period if self.enabled else 0.0
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[object, Tuple[float, float]]" = OrderedDict()
+
+    def hit(self, key, cost: float = 1.0) -> float:
+        """Take ``cost`` tokens; 0 if allowed, else seconds until it would be."""
+        if not self.enabled:
+            return 0.0
+        now = time.monotonic()
+        bucket = self._buckets.pop(key, None)
+        if bucket is None:
+            tokens = float(self.capacity)
+        else:
+            tokens, updated = bucket
+            tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+        wait = 0.0
+        if tokens >= cost:
+            tokens -= cost
+        else:
+            wait = (cost - tokens) / self.rate
+        self._buckets[key] = (tokens, now)
+        self._evict(now)
+        if wait:
+            rate_limited_total.inc()
+        return wait
+
+    def _evict(self, now: float) -> None:
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        while self._buckets:
+            key, (_, updated) = next(iter(self._buckets.items()))
+            if now - updated < self.period:
+                break
+            del self._buckets[key]
+
+    def check(self, key, detail: str = "Too many requests, slow down") -> None:
+        """Raise 429 with Retry-After when ``key`` is over the limit."""
+        wait = self.hit(key)
+        if wait:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail=detail,
+                headers={"Retry-After": str(max(1, math.ceil(wait)))},
+            )
+
+
+def client_ip(request) -> str:
+    # Works for Request and WebSocket; run uvicorn with --proxy-headers
+    # behind a reverse proxy so this is the real client address.
+    client = request.client
+    return client.host if client else "unknown"
+
+
+# Per-route limits, each overridable with RATE_LIMIT_<NAME>. Limits are
+# enforced per worker process.
+LIMITS: Dict[str, RateLimiter] = {
+    name: RateLimiter(name, os.getenv(f"RATE_LIMIT_{name.upper()}", default))
+    for name, default in (
+        ("send_user", "30/10s"),  # POST /messages/* per sender
+        ("send_ip", "120/10s"),  # POST /messages/* per client IP
+        ("auth_ip", "20/m"),  # /token and /register per client IP
+        ("ws_connect_ip", "30/m"),  # /ws handshakes per client IP
+        ("ws_frames_user", "20/10s"),  # frames received on /ws per user
+    )
+}
+
+
+def limit_ip(name: str):
+    """Dependency enforcing the ``name`` limit keyed by client IP."""
+    limiter = LIMITS[name]
+
+    async def dependency(request: Request):
+        limiter.check(client_ip(request))
+
+    return dependency
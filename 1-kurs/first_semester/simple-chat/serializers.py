@@ -0,0 +1,87 @@
+import json
+from datetime import date, datetime
+from operator import attrgetter
+from typing import Any, Iterable, List, Sequence
+
+from fastapi.responses import Response
+
+from models import PrivateMessage, User
+
+try:  # optional: several times faster than the json module, native datetimes
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:  # optional: binary WebSocket frames (see wsproto.py)
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+# Field order of the JSON objects; list endpoints select exactly these
+# columns and zip them with the names instead of loading ORM objects.
+MESSAGE_FIELDS = ("id", "sender_id", "receiver_id", "content", "created_at", "read_at")
+MESSAGE_COLUMNS = tuple(getattr(PrivateMessage, name) for name in MESSAGE_FIELDS)
+ME_FIELDS = ("id", "username", "first_name", "last_name", "bio", "created_at")
+USER_LIST_FIELDS = ("id", "username", "first_name", "last_name", "bio", "unread")
+
+_message_values = attrgetter(*MESSAGE_FIELDS)
+_me_values = attrgetter(*ME_FIELDS)
+
+
+def message_payload(m: PrivateMessage) -> dict:
+    return dict(zip(MESSAGE_FIELDS, _message_values(m)))
+
+
+def message_rows(rows: Iterable[Sequence]) -> List[dict]:
+    """Rows of ``select(*MESSAGE_COLUMNS)`` as message dicts."""
+    return [dict(zip(MESSAGE_FIELDS, row)) for row in rows]
+
+
+def user_rows(rows: Iterable[Sequence]) -> List[dict]:
+    """Rows selected in USER_LIST_FIELDS order as sidebar entries."""
+    return [dict(zip(USER_LIST_FIELDS, row)) for row in rows]
+
+
+def me_payload(user: User) -> dict:
+    return dict(zip(ME_FIELDS, _me_values(user)))
+
+
+def _default(value: Any):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    """JSON bytes; datetimes as ISO 8601, same as FastAPI's encoder."""
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(
+        content, default=_default, ensure_ascii=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+    """JSON response that skips ``jsonable_encoder``.
+
+    Returned directly from hot endpoints whose payloads are already plain
+    dicts, lists, strings, numbers and datetimes.
+    """
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+if msgpack is not None:
+
+    def packb(content: Any) -> bytes:
+        """MessagePack bytes; datetimes as ISO 8601 strings, as in JSON."""
+        return msgpack.packb(content, default=_default)
+
+    def unpackb(data: bytes) -> Any:
+        return msgpack.unpackb(data)
+
+else:  # pragma: no cover
+    packb = unpackb = None
@@ -0,0 +1,78 @@
+// Minimal MessagePack decoder for the chat.v1.msgpack WebSocket protocol.
+// Covers every type the server emits (no extension types).
+(function () {
+    const utf8 = new TextDecoder();
+
+    function decode(buffer) {
+        const bytes = buffer instanceof Uint8Array ? buffer : new Uint8Array(buffer);
+        const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+        let pos = 0;
+
+        function str(length) {
+            const value = utf8.decode(bytes.subarray(pos, pos + length));
+            pos += length;
+            return value;
+        }
+
+        function bin(length) {
+            const value = bytes.slice(pos, pos + length);
+            pos += length;
+            return value;
+        }
+
+        function array(length) {
+            const value = new Array(length);
+            for (let i = 0; i < length; i++) value[i] = read();
+            return value;
+        }
+
+        function map(length) {
+            const value = {};
+            for (let i = 0; i < length; i++) {
+                const key = read();
+                value[key] = read();
+            }
+            return value;
+        }
+
+        function read() {
+            const type = bytes[pos++];
+            if (type < 0x80) return type; // positive fixint
+            if (type < 0x90) return map(type & 0x0f);
+            if (type < 0xa0) return array(type & 0x0f);
+            if (type < 0xc0) return str(type & 0x1f);
+            if (type >= 0xe0) return type - 0x100; // negative fixint
+            let value;
+            switch (type) {
+                case 0xc0: return null;
+                case 0xc2: return false;
+                case 0xc3: return true;
+                case 0xc4: return bin(bytes[pos++]);
+                case 0xc5: { const n = view.getUint16(pos); pos += 2; return bin(n); }
+                case 0xc6: { const n = view.getUint32(pos); pos += 4; return bin(n); }
+                case 0xca: value = view.getFloat32(pos); pos += 4; return value;
+                case 0xcb: value = view.getFloat64(pos); pos += 8; return value;
+                case 0xcc: return bytes[pos++];
+                case 0xcd: value = view.getUint16(pos); pos += 2; return value;
+                case 0xce: value = view.getUint32(pos); pos += 4; return value;
+                case 0xcf: value = Number(view.getBigUint64(pos)); pos += 8; return value;
+                case 0xd0: value = view.getInt8(pos); pos += 1; return value;
+                case 0xd1: value = view.getInt16(pos); pos += 2; return value;
+                case 0xd2: value = view.getInt32(pos); pos += 4; return value;
+                case 0xd3: value = Number(view.getBigInt64(pos)); pos += 8; return value;
+                case 0xd9: return str(bytes[pos++]);
+                case 0xda: { const n = view.getUint16(pos); pos += 2; return str(n); }
+                case 0xdb: { const n = view.getUint32(pos); pos += 4; return str(n); }
+                case 0xdc: { const n = view.getUint16(pos); pos += 2; return array(n); }
+                case 0xdd: { const n = view.getUint32(pos); pos += 4; return array(n); }
+                case 0xde: { const n = view.getUint16(pos); pos += 2; return map(n); }
+                case 0xdf: { const n = view.getUint32(pos); pos += 4; return map(n); }
+                default: throw new Error('msgpack: unsupported type 0x' + type.toString(16));
+            }
+        }
+
+        return read();
+    }
+
+    window.msgpack = { decode };
+})();
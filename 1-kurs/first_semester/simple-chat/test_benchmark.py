@@ -0,0 +1,40 @@
+"""
+Smoke run of benchmark.py against a throwaway SQLite database.
+Run with: pytest test_benchmark.py (needs requirements-bench.txt)
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+for _module in ("httpx", "msgpack", "uvicorn", "websockets"):
+    pytest.importorskip(_module)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def test_benchmark_smoke(tmp_path):
+    # not the pool/batching/rate-limit settings other test modules export
+    env = {
+        key: value
+        for key, value in os.environ.items()
+        if not key.startswith(("DB_", "RATE_LIMIT_", "MESSAGE_BATCHING"))
+    }
+    env["DATABASE_URL"] = f"sqlite+aiosqlite:///{tmp_path}/bench.db"
+    env["AUTO_MIGRATE"] = "1"
+    args = ["--users", "40", "--messages", "200", "--duration", "1"]
+    run = subprocess.run(
+        [sys.executable, "benchmark.py", *args],
+        cwd=HERE,
+        env=env,
+        capture_output=True,
+        text=True,
+        timeout=300,
+    )
+    # benchmark.py exits non-zero when any scenario had errors
+    assert run.returncode == 0, run.stderr[-2000:]
+    results = json.loads(run.stdout)["results"]
+    assert set(results) == {"login", "users", "poll", "send", "ws"}
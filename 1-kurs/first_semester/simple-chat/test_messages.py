@@ -0,0 +1,121 @@
+"""
+Regression tests for the chat API (setup in conftest.py).
+Run with: pytest test_messages.py
+"""
+
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+from db import engine
+
+
+def test_poll_with_nothing_unread(client, login):
+    alice = login("alice1")
+    bob = login("bobby1")
+    sent = client.post("/messages/bobby1", data={"content": "hi"}, headers=alice)
+    assert sent.status_code == 200
+
+    # the first fetch marks the message read, the rest find nothing unread
+    for _ in range(2):
+        res = client.get("/messages/alice1", headers=bob)
+        assert res.status_code == 200
+        assert [m["content"] for m in res.json()] == ["hi"]
+    res = client.get(
+        "/messages/alice1", params={"after_id": sent.json()["id"]}, headers=bob
+    )
+    assert res.status_code == 200
+    assert res.json() == []
+
+
+def test_pages_interleave_both_directions(client, login):
+    carol = login("carol1")
+    dave = login("dave11")
+    sent = []
+    for i in range(7):
+        sender, to = (carol, "dave11") if i % 3 else (dave, "carol1")
+        res = client.post(f"/messages/{to}", data={"content": f"m{i}"}, headers=sender)
+        sent.append(res.json()["id"])
+
+    # newest first, walked back with before_id
+    seen = []
+    params = {"limit": 3}
+    while True:
+        page = client.get("/messages/dave11", params=params, headers=carol).json()
+        if not page:
+            break
+        seen = [m["id"] for m in page] + seen
+        params = {"limit": 3, "before_id": page[0]["id"]}
+    assert seen == sent
+
+    # and forward from the first message with after_id
+    page = client.get(
+        "/messages/carol1", params={"limit": 4, "after_id": sent[0]}, headers=dave
+    ).json()
+    assert [m["id"] for m in page] == sent[1:5]
+
+
+def test_public_chat_socket_gets_chat_lines_only(client, login):
+    erin = login("erin11")
+    frank = login("frank1")
+    token = frank["Authorization"].split(" ", 1)[1]
+    with client.websocket_connect(f"/ws?token={token}") as public:
+        res = client.post("/messages/frank1", data={"content": "private"}, headers=erin)
+        assert res.status_code == 200
+        public.send_text("hello all")
+        # no hello, no private message: the first frame is the chat line
+        assert public.receive_text() == "frank1: hello all"
+
+
+def test_user_search_treats_wildcards_literally(client, login):
+    login("gina_1")
+    login("ginax1")
+    me = login("henry1")
+
+    def search(q):
+        res = client.get("/users", params={"q": q}, headers=me)
+        assert res.status_code == 200
+        return sorted(u["username"] for u in res.json())
+
+    assert search("gina") == ["gina_1", "ginax1"]
+    assert search("gina_") == ["gina_1"]
+    assert search("%") == []
+    assert search("_") == []
+
+
+def test_batched_sends_beyond_pool_size(client, login):
+    ivan = login("ivan11")
+    login("judy11")
+
+    def send(i):
+        res = client.post("/messages/judy11", data={"content": f"c{i}"}, headers=ivan)
+        return res.status_code
+
+    # more concurrent sends than DB_POOL_SIZE + DB_MAX_OVERFLOW connections
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        assert list(pool.map(send, range(8))) == [200] * 8
+
+
+def test_conversation_pages_keep_ties(client, login):
+    kim = login("kim111")
+    for name in ("lena11", "mike11", "nora11"):
+        peer = login(name)
+        client.post("/messages/kim111", data={"content": "hey"}, headers=peer)
+    # three chats with the same last activity
+    with sqlite3.connect(engine.url.database) as db:
+        db.execute(
+            "UPDATE conversation SET last_activity_at = '2024-05-01 12:00:00.000000'"
+        )
+
+    seen = []
+    params = {"limit": 1}
+    while True:
+        page = client.get("/conversations", params=params, headers=kim).json()
+        if not page:
+            break
+        seen += [c["user"]["username"] for c in page]
+        params = {
+            "limit": 1,
+            "before": page[-1]["last_activity_at"],
+            "before_user": page[-1]["user"]["id"],
+        }
+    assert sorted(seen) == ["lena11", "mike11", "nora11"]
@@ -0,0 +1,126 @@
+"""
+PresenceRegistry ticks, driven by hand with recording callbacks.
+Run with: pytest test_presence.py
+"""
+
+import asyncio
+
+import pytest
+
+import presence
+from presence import PresenceRegistry
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+class Recorder:
+    def __init__(self):
+        self.published = []
+        self.delivered = []
+        self.expired = []
+
+    async def publish(self, envelope):
+        self.published.append(envelope)
+
+    def deliver(self, client, event):
+        self.delivered.append((client, event))
+
+    def expire(self, client):
+        self.expired.append(client)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(presence, "time", fake)
+    return fake
+
+
+@pytest.fixture
+def rec():
+    return Recorder()
+
+
+@pytest.fixture
+def registry(clock, rec):
+    return PresenceRegistry(rec.publish, rec.deliver, rec.expire, ttl=60)
+
+
+def tick(registry):
+    asyncio.run(registry._flush())
+
+
+def test_changes_coalesced_per_tick(registry, rec):
+    registry.join("w", 9)
+    registry.join("a", 1)
+    registry.watch("w", [1, 2])
+    assert rec.delivered == [("w", {"type": "presence", "online": [1], "offline": [2]})]
+    tick(registry)
+    rec.published.clear()
+    rec.delivered.clear()
+
+    # user 2 flaps and types within one tick: one envelope, one event
+    registry.join("b", 2)
+    registry.leave("b")
+    registry.join("b", 2)
+    registry.typed(2, 9)
+    tick(registry)
+    assert len(rec.published) == 1
+    assert rec.published[0]["online"] == [2]
+    assert rec.published[0]["offline"] == []
+    assert rec.published[0]["typing"] == [[2, 9]]
+    assert rec.delivered == [("w", {"type": "presence", "online": [2], "typing": [2]})]
+
+    # nothing new: nothing sent
+    tick(registry)
+    assert len(rec.published) == 1
+    assert len(rec.delivered) == 1
+
+
+def test_only_watched_contacts_delivered(registry, rec):
+    registry.join("w", 9)
+    registry.watch("w", [1, "x"])
+    assert rec.delivered == [("w", {"type": "presence", "online": [], "offline": [1]})]
+    rec.delivered.clear()
+
+    registry.join("c", 3)  # not watched
+    registry.typed(1, 5)  # typing to someone else
+    registry.join("a", 1)
+    tick(registry)
+    assert rec.delivered == [("w", {"type": "presence", "online": [1]})]
+
+    registry.unwatch("w")
+    registry.leave("a")
+    tick(registry)
+    assert len(rec.delivered) == 1
+
+
+def test_silent_sockets_and_stale_workers_expire(registry, rec, clock):
+    registry.join("w", 9)
+    registry.join("a", 1)
+    registry.watch("w", [7])
+    registry.apply({"kind": "presence", "worker": "other", "online": [7]})
+    # our own envelopes coming back over the backplane are ignored
+    registry.apply({"worker": registry.worker_id, "offline": [1]})
+    assert registry.is_online(7) and registry.is_online(1)
+    tick(registry)
+    rec.delivered.clear()
+
+    clock.now += 61
+    registry.touch("w")
+    registry._sweep()
+    assert rec.expired == ["a"]
+
+    # the other worker stopped refreshing its users: gone after 2 * ttl
+    clock.now += 60
+    registry.touch("w")
+    registry._sweep()
+    assert not registry.is_online(7)
+    tick(registry)
+    assert rec.delivered == [("w", {"type": "presence", "offline": [7]})]
@@ -0,0 +1,89 @@
+"""
+Token buckets in ratelimit.py, and how the app answers once one is empty.
+Run with: pytest test_ratelimit.py
+"""
+
+import pytest
+from starlette.websockets import WebSocketDisconnect
+
+import ratelimit
+from ratelimit import LIMITS, RateLimiter, parse_limit
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # only ratelimit's clock: the app's event loop keeps the real one
+    fake = FakeClock()
+    monkeypatch.setattr(ratelimit, "time", fake)
+    return fake
+
+
+def test_parse_limit():
+    assert parse_limit("30/10s") == (30, 10.0)
+    assert parse_limit("5/m") == (5, 60.0)
+    assert parse_limit("off") is None
+    assert parse_limit("0") is None
+    with pytest.raises(ValueError):
+        parse_limit("lots")
+
+
+def test_bucket_refills_over_the_period(clock):
+    limiter = RateLimiter("test", "2/10s")
+    assert limiter.hit("k") == 0
+    assert limiter.hit("k") == 0
+    # empty: one token comes back every 5 s
+    assert limiter.hit("k") == pytest.approx(5.0)
+    clock.now += 5
+    assert limiter.hit("k") == 0
+    assert limiter.hit("k") == pytest.approx(5.0)
+    # other keys have their own bucket
+    assert limiter.hit("other") == 0
+
+
+def test_buckets_evicted_by_count_and_idleness(clock):
+    limiter = RateLimiter("test", "1/10s", max_keys=2)
+    for key in ("a", "b", "c"):
+        limiter.hit(key)
+    assert list(limiter._buckets) == ["b", "c"]
+    # an evicted key starts over with a full bucket
+    assert limiter.hit("a") == 0
+
+    clock.now += 10
+    limiter.hit("d")
+    # everything idle for a whole period was full again, so it is dropped
+    assert list(limiter._buckets) == ["d"]
+
+
+def test_sends_over_the_limit_get_429(client, login, monkeypatch):
+    monkeypatch.setitem(LIMITS, "send_user", RateLimiter("send_user", "2/m"))
+    sender = login("olga11")
+    login("paul11")
+
+    codes = []
+    for _ in range(3):
+        res = client.post("/messages/paul11", data={"content": "hi"}, headers=sender)
+        codes.append(res.status_code)
+    assert codes == [200, 200, 429]
+    # the next token is 30 s away
+    assert res.headers["Retry-After"] == "30"
+
+
+def test_socket_sending_too_fast_is_closed(client, login, monkeypatch):
+    monkeypatch.setitem(LIMITS, "ws_frames_user", RateLimiter("ws_frames_user", "2/m"))
+    token = login("quinn1")["Authorization"].split(" ", 1)[1]
+    with client.websocket_connect(f"/ws?token={token}") as ws:
+        for i in range(2):
+            ws.send_text(f"m{i}")
+            assert ws.receive_text() == f"quinn1: m{i}"
+        ws.send_text("m2")
+        with pytest.raises(WebSocketDisconnect) as closed:
+            ws.receive_text()
+    assert closed.value.code == 1008
@@ -0,0 +1,49 @@
+import logging
+from typing import Optional, Set
+
+from sqlmodel import select
+
+from models import User
+
+logger = logging.getLogger(__name__)
+
+
+class UsernameIndex:
+    """Every taken username, held in memory to answer availability checks.
+
+    Usernames are never deleted or renamed, so membership is exact: a hit is
+    definitely taken. A miss can only be stale for a name just registered on
+    another worker, and that is broadcast over the backplane (the unique
+    constraint still guards registration itself).
+    """
+
+    def __init__(self):
+        self._names: Set[str] = set()
+        self.ready = False
+
+    async def warm(self, session_factory) -> None:
+        """Load every username; run as a background task on startup."""
+        try:
+            async with session_factory() as session:
+                result = await session.stream_scalars(
+                    select(User.username).execution_options(yield_per=10000)
+                )
+                async for username in result:
+                    self._names.add(username)
+        except Exception:
+            # stays cold: is_taken keeps answering None, callers ask the DB
+            logger.exception("Warming the username index failed")
+            return
+        self.ready = True
+
+    def add(self, username: str) -> None:
+        self._names.add(username)
+
+    def is_taken(self, username: str) -> Optional[bool]:
+        """True/False from memory, or None before the index is warm."""
+        if not self.ready:
+            return None
+        return username in self._names
+
+
+username_index = UsernameIndex()